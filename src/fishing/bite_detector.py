@@ -0,0 +1,161 @@
+import json
+import os
+
+import numpy as np
+
+
+# Pixels around the bobber watched for the splash of a bite
+BITE_PATCH_PADDING = 12
+# Frames of quiet water seen before a bite can be reported
+BASELINE_FRAMES = 8
+# Weight of the newest frame in the rolling baseline mean and variance
+BASELINE_DECAY = 0.1
+# Standard deviations from the baseline that make a bite
+BITE_Z_SCORE = 6.0
+# Smallest standard deviation assumed per statistic (0 - 255 scale), so a
+# perfectly still patch does not fire on a change of one brightness level
+MIN_STD = 2.0
+
+# BiteDetector settings per (zone, time of day), for water that is calmer or
+# busier than usual; a time of None applies at any time of day, and missing
+# settings keep the defaults above. Values come from `wowzer.py calibrate-bites`.
+BITE_PROFILES = {
+    # Calibrated on simulator recordings (harness.simulator fishes Feralas by day)
+    ("Feralas", "day"): {"z_score": 16.5},
+}
+# Profiles found by `wowzer.py calibrate-bites`, these win over BITE_PROFILES
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "bite_profiles.json")
+
+
+def _profile_key(zone, time_of_day):
+    return f"{zone}/{time_of_day}" if time_of_day else str(zone)
+
+
+# Profile files read so far, by path; save_profile keeps them up to date
+_loaded = {}
+
+
+def load_profiles(path=PROFILES_PATH):
+    """Calibrated profiles saved at path as {"Zone/time": settings}, {} if there are none.
+
+    The file is read once, later calls return the same dict.
+    """
+    profiles = _loaded.get(path)
+    if profiles is None:
+        profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                profiles = json.load(f)
+        _loaded[path] = profiles
+    return profiles
+
+
+def save_profile(zone, time_of_day, settings, path=PROFILES_PATH):
+    """Store calibrated detector settings for a zone (and time of day)"""
+    profiles = load_profiles(path)
+    profiles[_profile_key(zone, time_of_day)] = settings
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=4, sort_keys=True)
+
+
+def bite_profile(zone, time_of_day=None):
+    """BiteDetector keyword arguments for fishing in zone at time_of_day"""
+    calibrated = load_profiles()
+    keys = [(zone, None)] + ([(zone, time_of_day)] if time_of_day else [])
+    profile = {}
+    for key in keys:
+        profile.update(BITE_PROFILES.get(key, {}))
+        profile.update(calibrated.get(_profile_key(*key), {}))
+    return profile
+
+
+class BiteDetector:
+    """Tells a bite from the bobber just floating, over a patch of frames.
+
+    Each frame the HSV patch around the bobber is summed up as its
+    per-channel mean and standard deviation plus the mean absolute change
+    since the previous frame. A rolling (exponentially weighted) mean and
+    variance of these statistics is the baseline of the quiet water; a bite
+    is a frame where one of them is more than z_score standard deviations
+    off. update() reports it once, then the detector stays quiet until
+    start() is called for the next cast.
+    """
+
+    def __init__(self, padding=BITE_PATCH_PADDING, warmup=BASELINE_FRAMES, decay=BASELINE_DECAY,
+                 z_score=BITE_Z_SCORE, min_std=MIN_STD):
+        self.padding = padding
+        self.warmup = warmup
+        self.decay = decay
+        self.z_score = z_score
+        self.min_std = min_std
+        # The patch only follows the bobber once it drifted this far from where
+        # the patch was placed, a bobbing bobber keeps its baseline
+        self.tolerance = padding // 2
+        self.region = None
+        self._anchor = None
+        self.fired = False
+        self._reset_baseline()
+
+    def _reset_baseline(self):
+        self.frames = 0
+        self._mean = None
+        self._variance = None
+        self._previous = None
+        # z-score of the last frame, for logging and tuning
+        self.last_score = 0.0
+
+    def start(self, location, size):
+        """Watch the bobber of size (width, height) at top-left location, with a fresh baseline"""
+        self.fired = False
+        self._anchor = None
+        self.move(location, size)
+
+    def move(self, location, size):
+        """Follow a drifting bobber, True if the patch moved.
+
+        Moves within tolerance of where the patch was placed are ignored, the
+        padding keeps the bobber inside it. Otherwise the patch changed, so
+        the baseline starts over.
+        """
+        x, y = location
+        if self._anchor is not None and max(abs(x - self._anchor[0]), abs(y - self._anchor[1])) <= self.tolerance:
+            return False
+        self._anchor = (x, y)
+        self.region = (x - self.padding, y - self.padding,
+                       x + size[0] + self.padding, y + size[1] + self.padding)
+        self._reset_baseline()
+        return True
+
+    def statistics(self, patch):
+        """Mean and standard deviation per HSV channel plus the mean change since the last patch"""
+        patch = patch.astype(np.float32)
+        pixels = patch.reshape(-1, patch.shape[-1])
+        change = 0.0
+        if self._previous is not None and self._previous.shape == patch.shape:
+            change = float(np.abs(patch - self._previous).mean())
+        self._previous = patch
+        return np.concatenate([pixels.mean(axis=0), pixels.std(axis=0), [change]])
+
+    def update(self, frame):
+        """Feed a sight.frame_store.Frame, True on the frame the bite shows up in"""
+        if self.region is None or self.fired:
+            return False
+        stats = self.statistics(frame.convert("hsv", self.region))
+        if self._mean is None:
+            self._mean = stats
+            self._variance = np.zeros_like(stats)
+            self.frames = 1
+            return False
+
+        deviation = stats - self._mean
+        std = np.maximum(np.sqrt(self._variance), self.min_std)
+        self.last_score = float(np.abs(deviation / std).max())
+        if self.frames >= self.warmup and self.last_score >= self.z_score:
+            self.fired = True
+            return True
+
+        # Quiet frame: fold it into the baseline
+        self._mean = self._mean + self.decay * deviation
+        self._variance = (1 - self.decay) * (self._variance + self.decay * deviation ** 2)
+        self.frames += 1
+        return False
@@ -1,85 +1,277 @@
 
-import cv2 as cv
-import numpy as np
 import pyautogui
 import time
 from threading import Thread
 import os
 
+from fishing.bite_detector import BiteDetector, bite_profile
+from sight.matching import TemplateMatcher
+from sight.proposals import ColorProposals, match_proposals
+from sight.regions import screen_region
+from sight.search_mask import search_mask
+from sight.templates import registry
+from sight.tracking import ObjectTracker, TRACK_MIN_SCORE
+
+
+# Part of the screen (as fractions) where the bobber can land, used in ROI capture mode
+LURE_SEARCH_AREA = (0.2, 0.1, 0.8, 0.75)
+# Padding around the bobber kept in ROI capture mode while watching it
+LURE_WATCH_PADDING = 40
+# Capture frame rates requested while locating and while watching the bobber
+LOCATE_FPS = 10
+WATCH_FPS = 30
+# Bobber template scales tried when locating it, add e.g. 0.8 / 1.25 for other UI scales or zoom
+LURE_SCALES = (1.0,)
+# Seconds the bobber search may take before the parts still running are dropped
+LOCATE_TIMEOUT = 1.0
+
+# Seconds given to switch to the game window before the first cast
+START_DELAY = 10
+# Seconds after casting before the bobber can have landed; locate then looks
+# on every new frame, so the "locate" time in the session stats shows how
+# much of the wait is left to cut
+SETTLE_TIME = 1.0
+# Seconds locate keeps looking for the bobber before casting again
+LOCATE_WINDOW = 5.0
+# Seconds watched for a bite before reeling in anyway
+WATCH_TIMEOUT = 30
+# Seconds after reeling in for the bobber to disappear, then for auto loot
+LOOT_TIMEOUT = 2.0
+LOOT_DELAY = 0.5
+# The steps of one fishing cycle, in order
+STATES = ("cast", "settle", "locate", "watch", "reel", "loot")
+
 
 class FishingAgent:
     def __init__(self, main_agent):
         self.main_agent = main_agent
         
-        # interpolate here_path to get the path to the fishing target image
+        # interpolate here_path to get the path to the fishing target image,
+        # the registry only reads it from disk the first time
         here_path = os.path.dirname(os.path.realpath(__file__))
-        self.fishing_target = cv.imread(
+        self.fishing_target = registry.get(
             os.path.join(
                 here_path,
                 "assets", "fishing_target.png"
             )
         )
+        self.matcher = TemplateMatcher(LURE_SCALES)
+        # Picks the few spots with bobber colours, the only ones template matched
+        self.lure_proposals = ColorProposals([self.fishing_target], LURE_SCALES)
+        # Follows the bobber in a small window once find_lure has located it
+        self.lure_tracker = ObjectTracker(self.fishing_target)
+        # Watches the water around the bobber for the splash of a bite
+        self.bite_detector = BiteDetector()
         
+        self.fishing = False
+        self.lure_location = None
+        self.state = None
+        self.start_time = None
+        # Seconds spent in each state on every pass, and what the casts came to
+        self.state_times = {state: [] for state in STATES}
+        self.casts = 0
+        self.bites = 0
+        self.timeouts = 0
+        # Whether the last watch ended in a bite rather than a timeout
+        self.bitten = False
         self.fishing_thread = None
 
-    def cast_lure(self):
-        print("Casting!...")
+    def search_lure(self, frame):
+        """Full-screen search for the bobber, a sight.matching Match or None if it timed out or is not there"""
+        # The search can outlast two frame periods, keep the capture thread off this frame meanwhile
+        with self.main_agent.frames.hold(frame) as frame:
+            if frame is None:
+                return None
+            mask = self._search_mask(frame)
+            proposals = self.lure_proposals.propose(frame.bgr, mask=mask)
+            return match_proposals(self.matcher, frame.bgr, self.fishing_target, proposals,
+                                   executor=self.main_agent.vision, timeout=LOCATE_TIMEOUT, mask=mask)
+
+    def _search_mask(self, frame):
+        """Where the bobber can be: anywhere but the UI chrome of this zone's layout"""
+        return search_mask(self.main_agent.zone, (frame.shape[1], frame.shape[0]), self.main_agent.ui_layout)
+
+    def locate_lure(self, frame):
+        """Best bobber match in the frame as (location, confidence), (None, 0) if the search timed out"""
+        match = self.search_lure(frame)
+        if match is None:
+            return None, 0.0
+        return match.location, match.score
+
+    def _watch_region(self, location):
+        """Keep the area around the bobber in ROI capture mode"""
+        x, y = location
+        self.main_agent.capture_regions.register("fishing_lure", (
+            x - LURE_WATCH_PADDING, y - LURE_WATCH_PADDING,
+            x + LURE_WATCH_PADDING + 25, y + LURE_WATCH_PADDING + 25))
+
+    def follow_lure(self, frame):
+        """Re-verify the bobber near its last position and follow it if it drifted.
+
+        Only the tracker's small window is searched, never the whole screen,
+        so watching keeps up with every frame. While the bobber cannot be
+        seen (it dips under when a fish bites) the window stays where it was
+        last seen. Returns whether it was found.
+        """
+        last_match = self.lure_tracker.match
+        match = self.lure_tracker.update(frame, self._search_mask(frame))
+        if match is None:
+            self.lure_tracker.match = last_match
+            return False
+        if match.location != self.lure_location:
+            self.lure_location = match.location
+            self._watch_region(match.location)
+        return True
+
+
+    # The fishing cycle. Each state does its part and returns the next one, so
+    # fish_loop can go on for hours without growing the stack.
+
+    def fish_loop(self):
+        """Run the fishing cycle until stop_fishing()"""
         self.fishing = True
-        self.cast_time = time.time()
+        self.start_time = time.time()
+        # The game is on screen now, find where its UI is
+        self.main_agent.discover_layout()
+        self.state = "cast"
+        handlers = {state: getattr(self, "_" + state) for state in STATES}
+        while self.fishing:
+            state = self.state
+            started = time.time()
+            next_state = handlers[state]()
+            self.state_times[state].append(time.time() - started)
+            self.state = next_state
+
+    def _cast(self):
+        print("Casting!...")
+        height, width = self.main_agent.frames.latest().shape[:2]
+        self.main_agent.capture_regions.register(
+            "fishing_search", screen_region((width, height), *LURE_SEARCH_AREA))
+        self.main_agent.capture_regions.unregister("fishing_lure")
+        self.main_agent.request_fps("fishing", LOCATE_FPS)
+        self.lure_location = None
+        self.lure_tracker.reset()
         pyautogui.press('1')
-        time.sleep(3)
-        self.find_lure()
-
-    def find_lure(self):
-        start_time = time.time()
-        lure_location = cv.matchTemplate(self.main_agent.cur_img, self.fishing_target, cv.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(lure_location)
-        self.lure_location = max_loc
-        self.move_to_lure()
-
-    def move_to_lure(self):
-        if self.lure_location:
-            pyautogui.moveTo(self.lure_location[0] + 25, self.lure_location[1], .45, pyautogui.easeOutQuad)
-            self.watch_lure()
-        else:
-            print("Warning: Attempted to move to lure_location, but lure_location is None (fishing_agent.py line 32)")
-            return False
+        self.casts += 1
+        self._record("cast")
+        return "settle"
 
-    def watch_lure(self):
+    def _settle(self):
+        time.sleep(SETTLE_TIME)
+        return "locate"
+
+    def _locate(self):
+        """Search every new frame until the bobber shows up, or cast again"""
+        deadline = time.time() + LOCATE_WINDOW
+        last_frame_id = 0
+        while self.fishing and time.time() < deadline:
+            frame = self.main_agent.wait_for_frame(last_frame_id, timeout=1)
+            if frame is None:
+                continue
+            last_frame_id = frame.frame_id
+            match = self.search_lure(frame)
+            if match is not None and match.score >= TRACK_MIN_SCORE:
+                self.lure_location = match.location
+                self.lure_tracker.start(match)
+                self._watch_region(match.location)
+                self.main_agent.capture_regions.unregister("fishing_search")
+                pyautogui.moveTo(self.lure_location[0] + 25, self.lure_location[1], .45, pyautogui.easeOutQuad)
+                return "watch"
+        print("Could not find the bobber, casting again")
+        return "cast"
+
+    def _watch(self):
+        """Watch the bobber until a bite or WATCH_TIMEOUT"""
+        self.main_agent.request_fps("fishing", WATCH_FPS)
         time_start = time.time()
-        while True:
-            pixel = self.main_agent.cur_imgHSV[self.lure_location[1] + 25][self.lure_location[0]]            
-            if self.main_agent.zone == "Dustwallow":
-                if pixel[0] >= 20 or pixel[1] < 60 or pixel[2] < 40 or time.time() - time_start >= 30:
-                    print("Bite detected!")
-                    break
-            elif self.main_agent.zone == "Feralas" and self.main_agent.time == "night":
-                if pixel[0] >= 70:
-                    print("Bite detected!")
-                    break
-                if time.time() - time_start >= 30:
-                    print("Fishing timeout!")
-                    break
-            elif self.main_agent.zone == "Feralas":
-                print("Feralas")
-                if pixel[0] >= 60 or time.time() - time_start >= 30:
-                    print("Bite detected!")
-                    break
-            print(pixel)
-        self.pull_line()
-
-    def pull_line(self):
+        last_frame_id = 0
+        self.bitten = False
+        # Settings tuned for this zone's water, see fishing/bite_detector.py
+        self.bite_detector = BiteDetector(**bite_profile(self.main_agent.zone, self.main_agent.time))
+        # _locate just started the tracker with the bobber's match
+        self.bite_detector.start(self.lure_location, self.lure_tracker.match.size)
+        while self.fishing:
+            # Block until the capture thread publishes a frame we have not looked at yet.
+            # Every frame is checked: the change detector's sparse samples can miss a
+            # small splash, while the bite detector only reads a small patch anyway.
+            frame = self.main_agent.wait_for_frame(last_frame_id, timeout=1)
+            if frame is not None:
+                previous_id, last_frame_id = last_frame_id, frame.frame_id
+                if self.bite_detector.update(frame):
+                    print(f"Bite detected! ({self.bite_detector.last_score:.1f} standard deviations)")
+                    self.bites += 1
+                    self.bitten = True
+                    return "reel"
+                # Catch bobber drift; while it cannot be seen keep watching where it was,
+                # a bite shows there and the watch ends at WATCH_TIMEOUT if it is gone.
+                # Drift can only show in the tracker's window, nothing to follow while it did not change
+                location = self.lure_location
+                if (frame.changed_since(previous_id, self.lure_tracker.window())
+                        and self.follow_lure(frame) and self.lure_location != location):
+                    self.bite_detector.move(self.lure_location, self.lure_tracker.match.size)
+            if time.time() - time_start >= WATCH_TIMEOUT:
+                print("Fishing timeout!")
+                self.timeouts += 1
+                return "reel"
+        return "reel"
+
+    def _reel(self):
         pyautogui.rightClick()
+        self._record("reel", detected=self.bitten)
+        self.main_agent.release_fps("fishing")
         # os.system("sh -c 'xdotool keydown Shift_L; sleep 0.1; xdotool mousedown 3; sleep 0.1; xdotool mouseup 3; sleep 0.1; xdotool keyup Shift_L; sleep 0.1'")
-        time.sleep(1)
-        self.run()
+        return "loot"
+
+    def _loot(self):
+        """Wait for the bobber to go away and auto loot to finish"""
+        deadline = time.time() + LOOT_TIMEOUT
+        last_frame_id = 0
+        while self.lure_tracker.tracking and time.time() < deadline:
+            frame = self.main_agent.wait_for_frame(last_frame_id, timeout=1)
+            if frame is not None:
+                last_frame_id = frame.frame_id
+                self.lure_tracker.update(frame)
+        time.sleep(LOOT_DELAY)
+        print(f"Cast {self.casts} done, {self.casts_per_hour():.0f} casts/hour")
+        return "cast"
+
+    def _record(self, name, **data):
+        """Mark a step of the cycle in the recording, if one is made, for calibrate-bites"""
+        recorder = self.main_agent.recorder
+        if recorder is not None:
+            recorder.write_event(name, **data)
+
+    def casts_per_hour(self):
+        if self.start_time is None:
+            return 0.0
+        return self.casts / max(time.time() - self.start_time, 1e-6) * 3600
+
+    def report(self):
+        """Session counters plus the mean seconds spent in each state"""
+        report = {"casts": self.casts, "bites": self.bites, "timeouts": self.timeouts,
+                  "casts_per_hour": self.casts_per_hour()}
+        for state, times in self.state_times.items():
+            report[f"{state}_s"] = sum(times) / len(times) if times else 0.0
+        return report
+
+    def stop_fishing(self):
+        """Stop after the current state and print the session stats"""
+        if self.fishing:
+            self.fishing = False
+            print("\n===== Fishing Session Stats =====")
+            for key, value in self.report().items():
+                print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+            print("=================================\n")
+        self.main_agent.capture_regions.unregister("fishing_search")
+        self.main_agent.capture_regions.unregister("fishing_lure")
+        self.main_agent.release_fps("fishing")
 
-    def run(self):
-        if self.main_agent.cur_img is None:
+    def run(self, start_delay=START_DELAY):
+        if self.main_agent.frames.latest() is None:
             print("Image capture not found!  Did you start the screen capture thread?")
             return
-        print("Starting fishing thread in 10 seconds...")
-        time.sleep(10)
+        print(f"Starting fishing thread in {start_delay} seconds...")
+        time.sleep(start_delay)
         
         print("Switching to fishing hotbar (hotbar 4)")
         pyautogui.keyDown('shift')
@@ -88,7 +280,7 @@ class FishingAgent:
         time.sleep(1)
         
         self.fishing_thread = Thread(
-            target=self.cast_lure, 
+            target=self.fish_loop, 
             args=(),
             name="fishing thread",
             daemon=True)    
@@ -2,6 +2,8 @@ import pyautogui
 import time
 import random
 
+from grinding.config import DETECTION
+
 class LowLevelHunterCombat:
     """Gestion de combat simplifiée pour un Hunter niveau 1"""
     
@@ -9,17 +11,30 @@ class LowLevelHunterCombat:
         self.main_agent = main_agent
         self.in_combat = False
         self.target_acquired = False
+        # Vrai si le dernier combat s'est terminé par la mort de la cible
+        self.target_killed = False
         self.last_ability_time = {}
+        # Santé lue au dernier passage de la boucle, pour voir si l'on prend des coups
+        self.last_health = None
+        # Appelée à chaque passage de la boucle pour suivre la cible à l'écran
+        self.follow = None
         
-    def start_combat(self, target_location):
-        """Commence le combat avec une cible"""
+    def start_combat(self, target_location, follow=None):
+        """Commence le combat avec une cible (follow : fonction qui suit la cible pendant le combat)"""
         print("Commencer le combat avec la cible")
+        self.target_killed = False
+        self.follow = follow
         
         # Cibler l'ennemi (clic droit)
         if target_location:
             target_x = target_location[0] + random.randint(-5, 5)  # Ajouter une petite variation
             target_y = target_location[1] + random.randint(-5, 5)
             
+            # Effacer la cible morte du dernier combat, qui reste affichée avec une
+            # barre vide ; sans cible, Échap ouvrirait le menu du jeu
+            if self._target_is_dead():
+                pyautogui.press('esc')
+            
             # Se déplacer vers la cible mais garder distance
             pyautogui.moveTo(target_x, target_y, duration=0.3)
             pyautogui.rightClick()  # Cible l'ennemi
@@ -41,9 +56,20 @@ class LowLevelHunterCombat:
         start_time = time.time()
         
         while self.in_combat and time.time() - start_time < 30:  # Timeout de sécurité
+            # Suivre la cible, sa position sert au pillage et à la reprise du combat
+            if self.follow is not None:
+                self.follow()
+            
             # Vérifier si la cible est morte
             if self._target_is_dead():
                 print("Cible éliminée!")
+                self.target_killed = True
+                self.in_combat = False
+                break
+            
+            # Vérifier si le clic a raté la cible ou si elle a été perdue
+            if self._target_is_lost():
+                print("Pas de cible, fin du combat")
                 self.in_combat = False
                 break
             
@@ -114,33 +140,34 @@ class LowLevelHunterCombat:
         return current_time - last_use >= cooldown
     
     def _target_is_dead(self):
-        """Vérifie si la cible est morte"""
-        # En réalité, on voudrait vérifier la barre de vie de la cible
-        # Pour un prototype simple, on utilise une probabilité basée
-        # sur le temps écoulé depuis le début du combat
-        combat_time = time.time() - self.last_ability_time.get("auto_shot", time.time())
-        
-        # Plus le combat dure longtemps, plus il est probable que l'ennemi soit mort
-        if combat_time > 15:
-            return random.random() < 0.9  # 90% de chance d'être mort après 15 secondes
-        elif combat_time > 10:
-            return random.random() < 0.7  # 70% de chance d'être mort après 10 secondes
-        elif combat_time > 5:
-            return random.random() < 0.3  # 30% de chance d'être mort après 5 secondes
-            
-        return False
+        """Vérifie si la cible est morte (son cadre est affiché avec une barre de vie vide)"""
+        state = self.main_agent.ui_state
+        if state is None or state.target_health is None:
+            # Pas de cadre de cible : rien n'est mort, il n'y a pas de cible
+            return False
+        return state.target_health <= 0.0
+    
+    def _target_is_lost(self):
+        """Vérifie s'il n'y a plus de cadre de cible alors que l'on n'est pas en combat"""
+        state = self.main_agent.ui_state
+        return state is not None and state.target_health is None and not state.in_combat
     
     def _health_is_low(self):
         """Vérifie si la santé du joueur est basse"""
-        # À implémenter avec détection réelle de la barre de vie
-        # Pour l'instant, une chance aléatoire faible
-        return random.random() < 0.05  # 5% de chance que la santé soit considérée basse
+        state = self.main_agent.ui_state
+        if state is None or state.health is None:
+            return False
+        return state.health * 100 < DETECTION["health_low"]
     
     def _is_in_melee_range(self):
         """Vérifie si le joueur est au corps à corps avec la cible"""
-        # À implémenter avec détection réelle
-        # Pour l'instant, aléatoire
-        return random.random() < 0.2  # 20% de chance d'être au corps à corps
+        # Un Hunter qui perd de la vie en combat est frappé, donc la cible est au contact
+        state = self.main_agent.ui_state
+        if state is None or state.health is None:
+            return False
+        took_damage = self.last_health is not None and state.health < self.last_health
+        self.last_health = state.health
+        return state.in_combat and took_damage
     
     def _reset_combat(self):
         """Réinitialise l'état de combat"""
@@ -37,6 +37,9 @@ HUNTER_LEVEL1_ABILITIES = {
 SETTINGS = {
     "combat_distance": 15,    # Distance to start combat (in pixels)
     "rest_threshold": 50,     # Health % to rest
+    "rest_until": 95,         # Health % at which resting stops
+    "rest_timeout": 30,       # Longest rest in seconds
+    "combat_linger": 5,       # Seconds the UI may show combat after a fight before fighting on
     "grinding_radius": 100,   # Radius to search for enemies
     "avoid_level": 3,         # Avoid mobs with level > player level + this value
     "target_priority": [      # Target priority order
@@ -49,6 +52,19 @@ SETTINGS = {
 # Detection thresholds
 DETECTION = {
     "enemy_confidence": 0.65,  # Confidence threshold for enemy detection
+    "template_scales": (1.0,), # Template sizes tried, add e.g. 0.8 / 1.25 for other UI scales
+    "scan_timeout": 0.5,       # Seconds a target or loot scan may take before late parts are dropped
+    "pull_radius": 250,        # Pixels around a target in which other enemies may join the fight
+    "color_proposals": True,   # Only template-match where enemy colours show up (sight/proposals.py)
+    # Extra HSV ranges proposed as enemies, e.g. [((0, 150, 120), (8, 255, 255))] for red nameplates
+    "proposal_hsv_ranges": [],
     "health_low": 60,          # Health % considered "low"
     "loot_radius": 30          # Search radius for loot in pixels
+}
+
+# Capture frame rates requested by the grinding agent in each activity
+CAPTURE_FPS = {
+    "search": 10,   # Scanning for targets
+    "combat": 15,   # Fighting and looting
+    "rest": 2       # Sitting and recovering, nothing time-critical
 }
\ No newline at end of file
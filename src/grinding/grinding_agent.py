@@ -1,5 +1,3 @@
-import cv2 as cv
-import numpy as np
 import pyautogui
 import time
 from threading import Thread
@@ -8,9 +6,17 @@ import random
 
 # Import our combat module and configuration
 from grinding.combat import LowLevelHunterCombat
-from grinding.config import TARGETS, ELWYNN_STARTING_WAYPOINTS, SETTINGS, DETECTION
+from grinding.config import TARGETS, ELWYNN_STARTING_WAYPOINTS, SETTINGS, DETECTION, CAPTURE_FPS
+from sight.matching import Match, TemplateMatcher, TemplateBatch
+from sight.proposals import ColorProposals, detect_proposals
+from sight.search_mask import search_mask
+from sight.templates import registry
+from sight.tracking import ObjectTracker
 
 
+# Seconds between starting the agent and the first scan
+START_DELAY = 5
+
 class GrindingAgent:
     def __init__(self, main_agent):
         self.main_agent = main_agent
@@ -22,13 +28,34 @@ class GrindingAgent:
         self.here_path = os.path.dirname(os.path.realpath(__file__))
         self.enemy_templates = self._load_enemy_templates()
         self.loot_template = self._load_image('assets/ui/loot.png')
+        self.matcher = TemplateMatcher(DETECTION["template_scales"])
+        # All enemy templates are matched together in one pass over the frame
+        self.enemy_detector = TemplateBatch(self.enemy_templates, DETECTION["template_scales"])
+        # ...and only in the parts of it showing enemy colours
+        self.enemy_proposals = None
+        if DETECTION["color_proposals"]:
+            self.enemy_proposals = ColorProposals(self.enemy_templates.values(), DETECTION["template_scales"],
+                                                  DETECTION["proposal_hsv_ranges"])
         
         # State tracking
         self.is_grinding = False
         self.target_found = False
         self.in_combat = False
         self.target_location = None
+        # (width, height) of the target on screen, from its detection
+        self.target_size = None
+        # Follows the last target found, during the fight and into the next scan
+        self.target_tracker = None
+        # Every enemy seen in the last full scan as (name, bbox, score)
+        self.detections = []
+        # When the combat manager finished a fight the UI still shows as ongoing
+        self.fight_ended = None
+        # Where mobs killed while the fight went on died, looted once it is over
+        self.corpses = []
         self.grinding_thread = None
+        self.last_frame_id = 0
+        # Part of the screen enemies and corpses are searched in, grabbed in ROI capture mode
+        self.play_area = None
         
         # Stats tracking
         self.kills = 0
@@ -39,8 +66,7 @@ class GrindingAgent:
         print("Grinding Agent initialized for a Level 1 Hunter in Elwynn Forest")
     
     def _load_enemy_templates(self):
-        """Load enemy template images from assets folder"""
-        templates = {}
+        """Enemy templates from the assets folder and its folder for the current zone"""
         enemy_dir = os.path.join(self.here_path, 'assets', 'enemies')
         
         # Check if directory exists
@@ -48,15 +74,12 @@ class GrindingAgent:
             os.makedirs(enemy_dir, exist_ok=True)
             print(f"Created directory: {enemy_dir}")
             print("Please add enemy template images to this directory")
-            return templates
+            return {}
         
-        # Load any PNG files in the directory
-        for filename in os.listdir(enemy_dir):
-            if filename.endswith('.png'):
-                enemy_name = filename[:-4]  # Remove .png extension
-                image_path = os.path.join(enemy_dir, filename)
-                templates[enemy_name] = cv.imread(image_path)
-                print(f"Loaded enemy template: {enemy_name}")
+        # Loaded (with any .png/.PNG/.jpg name) once per process and zone, then shared
+        templates = registry.group(enemy_dir, self.main_agent.zone)
+        for enemy_name in templates:
+            print(f"Loaded enemy template: {enemy_name}")
         
         if not templates:
             print("WARNING: No enemy templates found. Please add template images.")
@@ -64,10 +87,11 @@ class GrindingAgent:
         return templates
     
     def _load_image(self, relative_path):
-        """Load a single image from assets folder"""
+        """Load a single image from assets folder (file name case does not matter)"""
         full_path = os.path.join(self.here_path, relative_path)
-        if os.path.exists(full_path):
-            return cv.imread(full_path)
+        template = registry.get(full_path)
+        if template is not None:
+            return template
         else:
             parent_dir = os.path.dirname(full_path)
             if not os.path.exists(parent_dir):
@@ -80,14 +104,20 @@ class GrindingAgent:
         print("Starting grinding sequence...")
         self.is_grinding = True
         self.start_time = time.time()
+        # The game is on screen now, find where its UI is
+        self.main_agent.discover_layout()
+        self.main_agent.wait_for_frame(0)
+        self._register_play_area(self._search_mask(self.main_agent.frames.latest()))
+        self.main_agent.request_fps("grinding", CAPTURE_FPS["search"])
         
-        # Main grinding loop
+        # Main grinding loop, run once per captured frame instead of polling
+        last_id = 0
         while self.is_grinding:
-            # Make sure we have screen capture
-            if self.main_agent.cur_img is None:
+            frame = self.main_agent.wait_for_frame(last_id, timeout=1)
+            if frame is None:
                 print("No screen capture available. Waiting...")
-                time.sleep(1)
                 continue
+            last_id = frame.frame_id
             
             # Check player health
             if not self._check_health():
@@ -98,7 +128,8 @@ class GrindingAgent:
             if not self.in_combat:
                 if not self.find_target():
                     self._move_and_search()
-                    time.sleep(1)  # Prevent CPU hogging
+                    # Scan again on a frame captured after the movement
+                    self.main_agent.wait_for_frame(timeout=1)
                     continue
                 else:
                     self.approach_target()
@@ -108,57 +139,133 @@ class GrindingAgent:
             else:
                 if self._check_combat_ended():
                     self.in_combat = False
-                    self.kills += 1
-                    print(f"Combat ended. Total kills: {self.kills}")
-                    self._loot()
-            
-            # Small pause to prevent CPU overuse
-            time.sleep(0.5)
+                    self.fight_ended = None
+                    self.target_tracker = None
+                    if self.combat_manager.target_killed:
+                        self.corpses.append(self.target_location)
+                    if not self.corpses:
+                        print("Combat ended without a kill (target missed or lost)")
+                    for corpse in self.corpses:
+                        self.kills += 1
+                        print(f"Combat ended. Total kills: {self.kills}")
+                        self._loot(corpse)
+                    self.corpses = []
+                    self.main_agent.request_fps("grinding", CAPTURE_FPS["search"])
+                elif not self.combat_manager.in_combat:
+                    self._fight_on()
+    
+    def _register_play_area(self, mask):
+        """Tell the capture thread to grab what the search mask lets enemies and corpses be found in.
+
+        That is all of the world view outside the UI, so grinding saves far
+        less in ROI capture mode than fishing does.
+        """
+        if mask.bounds != self.play_area:
+            self.play_area = mask.bounds
+            self.main_agent.capture_regions.register("grinding_play_area", self.play_area)
     
     def find_target(self):
         """Scan screen for enemy targets"""
-        print("Scanning for targets...")
-        
-        if not self.enemy_templates or self.main_agent.cur_img is None:
+        # A scan can outlast two frame periods, keep the capture thread off the frame meanwhile
+        with self.main_agent.frames.hold() as frame:
+            return self._find_target(frame)
+    
+    def _find_target(self, frame):
+        if not self.enemy_templates or frame is None:
             return False
         
-        best_match = None
-        best_match_value = 0
-        best_match_name = None
+        mask = self._search_mask(frame)
+        # Follows the search mask once the UI layout is found
+        self._register_play_area(mask)
         
-        # Try to find each enemy type in our templates
-        for enemy_name, template in self.enemy_templates.items():
-            if template is None:
-                continue
-                
-            try:
-                # Use template matching
-                result = cv.matchTemplate(
-                    self.main_agent.cur_img,
-                    template,
-                    cv.TM_CCOEFF_NORMED
-                )
-                
-                min_val, max_val, min_loc, max_loc = cv.minMaxLoc(result)
-                
-                # If match confidence is high enough and better than previous matches
-                if max_val > DETECTION["enemy_confidence"] and max_val > best_match_value:
-                    best_match = max_loc
-                    best_match_value = max_val
-                    best_match_name = enemy_name
-            except Exception as e:
-                print(f"Error matching template for {enemy_name}: {e}")
-        
-        # If we found a good match
-        if best_match:
-            self.target_location = best_match
+        # Nothing moved in the play area since the last scan, its result still holds
+        if self.last_frame_id and not frame.changed_since(self.last_frame_id, self.play_area):
+            self.last_frame_id = frame.frame_id
+            return self.target_found
+        self.last_frame_id = frame.frame_id
+        
+        # Re-find the last target near where it was; the full scan is only needed once it is lost
+        if self.target_tracker is not None:
+            match = self.target_tracker.update(frame, mask)
+            if match is not None:
+                self.target_location = match.location
+                self.target_size = match.size
+                self.target_found = True
+                return True
+            self.target_tracker = None
+        
+        print("Scanning for targets...")
+        
+        try:
+            # Every enemy on screen, for all our templates at once
+            proposals = None
+            if self.enemy_proposals is not None:
+                proposals = self.enemy_proposals.propose(frame.bgr, mask=mask)
+            self.detections = detect_proposals(
+                self.enemy_detector, frame.bgr, DETECTION["enemy_confidence"], proposals,
+                executor=self.main_agent.vision, timeout=DETECTION["scan_timeout"], mask=mask)
+        except Exception as e:
+            print(f"Error matching enemy templates: {e}")
+            self.detections = []
+        
+        target = self.select_target(self.detections)
+        if target:
+            name, bbox, score = target
+            self.target_location = bbox[:2]
+            self.target_size = (bbox[2] - bbox[0], bbox[3] - bbox[1])
             self.target_found = True
-            print(f"Target found: {best_match_name} at {best_match} with confidence {best_match_value:.2f}")
+            self.target_tracker = ObjectTracker(
+                self.enemy_templates[name], min_score=DETECTION["enemy_confidence"])
+            self.target_tracker.start(Match(bbox[:2], score, self._detection_scale(target), self.target_size))
+            print(f"Target found: {name} at {bbox[:2]} with confidence {score:.2f} "
+                  f"({len(self.detections)} enemies visible)")
             return True
         
         self.target_found = False
         return False
     
+    def _search_mask(self, frame):
+        """No enemies or loot under the unit frames, minimap, chat or action bars"""
+        return search_mask(self.main_agent.zone, (frame.shape[1], frame.shape[0]), self.main_agent.ui_layout)
+    
+    def follow_target(self):
+        """Keep target_location on the target while it moves during the fight, for looting and re-engaging"""
+        frame = self.main_agent.frames.latest()
+        if self.target_tracker is None or not self.target_tracker.tracking or frame is None:
+            return
+        match = self.target_tracker.update(frame, self._search_mask(frame))
+        if match is not None:
+            self.target_location = match.location
+            self.target_size = match.size
+    
+    def select_target(self, detections):
+        """Pick the enemy to pull from the last scan's detections.
+
+        Prefers the TARGETS order, then enemies with the fewest others within
+        DETECTION["pull_radius"] (less risk of pulling several), then score.
+        """
+        if not detections:
+            return None
+        priority = [name.lower().replace(' ', '_') for name in TARGETS]
+        centres = [((left + right) / 2, (top + bottom) / 2) for name, (left, top, right, bottom), score in detections]
+        
+        def pull_cost(i):
+            name, bbox, score = detections[i]
+            key = name.lower().replace(' ', '_')
+            rank = priority.index(key) if key in priority else len(priority)
+            x, y = centres[i]
+            neighbours = sum(1 for j, (cx, cy) in enumerate(centres)
+                             if j != i and (cx - x) ** 2 + (cy - y) ** 2 <= DETECTION["pull_radius"] ** 2)
+            return (rank, neighbours, -score)
+        
+        return detections[min(range(len(detections)), key=pull_cost)]
+    
+    def _detection_scale(self, detection):
+        """Template scale a detection was found at, from its width"""
+        name, (left, top, right, bottom), score = detection
+        width = self.enemy_templates[name].shape[1]
+        return min(DETECTION["template_scales"], key=lambda scale: abs(scale * width - (right - left)))
+    
     def approach_target(self):
         """Move character to the target"""
         if not self.target_found or self.target_location is None:
@@ -166,8 +273,8 @@ class GrindingAgent:
             
         print(f"Approaching target at {self.target_location}")
         
-        # Calculate center of target (adjust based on your template size)
-        h, w = 50, 50  # Default size - should match your template
+        # Aim for the centre of the target as it was detected
+        w, h = self.target_size or (50, 50)
         target_x = self.target_location[0] + w//2
         target_y = self.target_location[1] + h//2
         
@@ -181,64 +288,87 @@ class GrindingAgent:
         """Start combat with the current target"""
         print("Engaging combat...")
         self.in_combat = True
+        self.main_agent.request_fps("grinding", CAPTURE_FPS["combat"])
         
         # Start combat using our combat manager
-        self.combat_manager.start_combat(self.target_location)
+        self.combat_manager.start_combat(self.target_location, follow=self.follow_target)
+    
+    def _fight_on(self):
+        """The combat manager is done but the UI still shows combat: an add, or a mob that outlived the timeout"""
+        now = time.time()
+        if self.fight_ended is None:
+            self.fight_ended = now
+        if now - self.fight_ended < SETTINGS["combat_linger"]:
+            # The combat flag stays up for a moment after the last hit
+            return
+        self.fight_ended = None
+        if self.combat_manager.target_killed:
+            # The next fight starts over; the kill is counted and looted once things calm down
+            self.corpses.append(self.target_location)
+            print("Target killed, still in combat")
+        print("Still in combat, re-engaging...")
+        # Scan even if the frame looks like the last scanned one, that scan is from before the fight
+        self.last_frame_id = 0
+        if self.find_target():
+            self.approach_target()
+        self.engage_combat()
     
     def _check_health(self):
         """Check if health is sufficient to continue"""
-        # Placeholder - should implement pixel detection of health bar
-        # For now, always return True
-        return True
+        state = self.main_agent.ui_state
+        if state is None or state.health is None:
+            # Health bar not visible, keep going
+            return True
+        return state.health * 100 >= SETTINGS["rest_threshold"]
     
     def _check_combat_ended(self):
         """Check if current combat has ended"""
-        # This should check the UI for combat state
-        # For now, delegate to combat manager
-        return not self.combat_manager.in_combat
+        # The combat manager is done with its target and the UI no longer shows us in combat
+        state = self.main_agent.ui_state
+        return not self.combat_manager.in_combat and not (state is not None and state.in_combat)
     
-    def _loot(self):
-        """Loot items from defeated enemies"""
+    def _loot(self, corpse=None):
+        """Loot items from defeated enemies, by the loot icon or else at corpse (default: the target's location)"""
+        if corpse is None:
+            corpse = self.target_location
         print("Attempting to loot...")
         
         # Wait for loot to be available
         time.sleep(1.0)
         
         # If we have a loot icon template, search for it
-        if self.loot_template is not None and self.main_agent.cur_img is not None:
-            try:
-                result = cv.matchTemplate(
-                    self.main_agent.cur_img,
-                    self.loot_template,
-                    cv.TM_CCOEFF_NORMED
-                )
-                
-                min_val, max_val, min_loc, max_loc = cv.minMaxLoc(result)
-                
-                if max_val > 0.6:  # Threshold for loot icon detection
-                    # Move to loot location and click
-                    h, w = self.loot_template.shape[:2]
-                    loot_x = max_loc[0] + w//2
-                    loot_y = max_loc[1] + h//2
-                    
-                    pyautogui.moveTo(loot_x, loot_y, 0.3)
-                    pyautogui.rightClick()
-                    
-                    # Wait for loot window and press spacebar to loot all
-                    time.sleep(0.5)
-                    pyautogui.press('space')
-                    
-                    self.loot_collected += 1
-                    print(f"Loot collected! Total: {self.loot_collected}")
-                    return
-            except Exception as e:
-                print(f"Error during looting: {e}")
+        match = None
+        with self.main_agent.frames.hold() as frame:
+            if self.loot_template is not None and frame is not None:
+                try:
+                    mask = self._search_mask(frame)
+                    match = self.matcher.match(frame.bgr, self.loot_template, executor=self.main_agent.vision,
+                                               timeout=DETECTION["scan_timeout"], mask=mask)
+                except Exception as e:
+                    print(f"Error during looting: {e}")
+        
+        if match is not None and match.score > 0.6:  # Threshold for loot icon detection
+            # Move to loot location and click
+            w, h = match.size
+            loot_x = match.location[0] + w//2
+            loot_y = match.location[1] + h//2
+            
+            pyautogui.moveTo(loot_x, loot_y, 0.3)
+            pyautogui.rightClick()
+            
+            # Wait for loot window and press spacebar to loot all
+            time.sleep(0.5)
+            pyautogui.press('space')
+            
+            self.loot_collected += 1
+            print(f"Loot collected! Total: {self.loot_collected}")
+            return
         
         # If no loot template or not found, try to loot near the last target location
-        if self.target_location:
+        if corpse:
             # Move slightly to where the corpse should be
-            loot_x = self.target_location[0] + random.randint(-10, 10)
-            loot_y = self.target_location[1] + random.randint(-5, 5)
+            loot_x = corpse[0] + random.randint(-10, 10)
+            loot_y = corpse[1] + random.randint(-5, 5)
             
             pyautogui.moveTo(loot_x, loot_y, 0.3)
             pyautogui.rightClick()
@@ -268,15 +398,22 @@ class GrindingAgent:
     def _rest(self):
         """Rest to recover health/mana"""
         print("Resting to recover...")
+        self.main_agent.request_fps("grinding", CAPTURE_FPS["rest"])
         
         # Sit down to recover faster if needed
         # pyautogui.press('x')  # Assuming 'x' is sit/stand
         
-        # Wait for recovery
-        time.sleep(5)
+        # Wait for recovery, until health is nearly full again
+        start = time.time()
+        while time.time() - start < SETTINGS["rest_timeout"]:
+            state = self.main_agent.ui_state
+            if state is None or state.health is None or state.health * 100 >= SETTINGS["rest_until"]:
+                break
+            time.sleep(1)
         
         # Stand up if needed
         # pyautogui.press('x')
+        self.main_agent.request_fps("grinding", CAPTURE_FPS["search"])
     
     def stop_grinding(self):
         """Stop the grinding process"""
@@ -296,18 +433,21 @@ class GrindingAgent:
             
         self.is_grinding = False
         self.combat_manager.in_combat = False
+        self.main_agent.capture_regions.unregister("grinding_play_area")
+        self.play_area = None
+        self.main_agent.release_fps("grinding")
     
-    def run(self):
-        """Run the grinding agent in a separate thread"""
-        if self.main_agent.cur_img is None:
+    def run(self, start_delay=START_DELAY):
+        """Run the grinding agent in a separate thread, after start_delay seconds to get ready"""
+        if self.main_agent.frames.latest() is None:
             print("Image capture not found! Did you start the screen capture thread?")
             print("Please press 'S' first to start screen capture.")
             return
             
-        print("Starting grinding thread in 5 seconds...")
+        print(f"Starting grinding thread in {start_delay} seconds...")
         print("Make sure your character is in a safe position.")
         print("Press 'Q' at any time to stop the bot.")
-        time.sleep(5)
+        time.sleep(start_delay)
         
         self.grinding_thread = Thread(
             target=self.start_grinding,
@@ -36,9 +36,13 @@ class Navigator:
         self.last_position = None
         self.position_history = []  # For stuck detection
         
-        # Minimap detection
-        self.minimap_center = (1280, 100)  # Default - should be detected
+        # Minimap as found by the UI layout discovery, see sight.ui_layout
+        self.minimap_center = (1280, 100)
         self.minimap_radius = 60
+        layout = main_agent.ui_layout
+        if layout is not None and layout.minimap is not None:
+            self.minimap_center = layout.minimap[:2]
+            self.minimap_radius = layout.minimap[2]
     
     def navigate_to_grinding_area(self):
         """Navigate to the appropriate grinding area based on zone"""
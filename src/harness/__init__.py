@@ -0,0 +1,2 @@
+# Offline harness: replay recorded sessions or simulate the game, with input redirected to a logging sink
+from harness.input_sink import InputSink, install_input_sink
\ No newline at end of file
@@ -0,0 +1,148 @@
+from bisect import bisect_left
+
+import numpy as np
+
+from harness.input_sink import install_input_sink
+
+
+# z-score thresholds tried, from eager to strict
+Z_CANDIDATES = np.arange(3.0, 30.5, 0.5)
+# Largest share of casts a threshold may end early on a false bite
+MAX_FALSE_RATE = 0.05
+# A trigger this many seconds before the labelled bite still counts as on
+# time (the label and the first splash frame are not captured together)
+LABEL_SLACK = 0.1
+# Mean delays closer than this (seconds, about a frame) count as equally fast
+DELAY_TOLERANCE = 0.02
+
+
+def cast_windows(recording):
+    """(cast time, bite time or None, reel time, reel was a detected bite) for every cast of a recording"""
+    windows = []
+    cast = bite = None
+    for event in sorted(recording.events, key=lambda event: event['timestamp']):
+        if event['name'] == 'cast':
+            cast, bite = event['timestamp'], None
+        elif event['name'] == 'bite' and cast is not None:
+            bite = event['timestamp']
+        elif event['name'] == 'reel' and cast is not None:
+            windows.append((cast, bite, event['timestamp'], event.get('detected', False)))
+            cast = bite = None
+    return windows
+
+
+def window_scores(fishing, recording, start, end, profile):
+    """[(timestamp, z-score)] the bite detector gives every frame of one cast, once past its warmup.
+
+    The detector is run with an unreachable threshold. Its baseline only
+    takes in frames that did not fire, so up to the first frame reaching a
+    threshold z the scores are the same as with z itself: the first score
+    >= z is where a detector with that threshold would have fired.
+    """
+    from fishing.bite_detector import BiteDetector
+    from fishing.fishing_agent import SETTLE_TIME
+    from sight.tracking import TRACK_MIN_SCORE
+
+    detector = BiteDetector(**dict(profile, z_score=np.inf))
+    tracker = fishing.lure_tracker
+    tracker.reset()
+    scores = []
+    timestamps = [entry.timestamp for entry in recording.frames]
+    for index in range(bisect_left(timestamps, start + SETTLE_TIME), bisect_left(timestamps, end)):
+        entry = recording.frames[index]
+        frame = fishing.main_agent.frames.publish(recording.image(index), entry.color_order, entry.timestamp)
+        if not tracker.tracking:
+            match = fishing.search_lure(frame)
+            if match is not None and match.score >= TRACK_MIN_SCORE:
+                tracker.start(match)
+                detector.start(match.location, match.size)
+            continue
+        location = tracker.location
+        match = tracker.update(frame)
+        if match is not None and match.location != location:
+            detector.move(match.location, match.size)
+        detector.update(frame)
+        if detector.frames > detector.warmup:
+            scores.append((entry.timestamp, detector.last_score))
+    return scores
+
+
+def evaluate(casts, z_score):
+    """(mean seconds from bite to trigger, false trigger rate) of a threshold over the scored casts.
+
+    A bite that never triggers costs the rest of its cast.
+    """
+    delays = []
+    false_triggers = 0
+    for bite, end, scores in casts:
+        trigger = next((t for t, score in scores if score >= z_score), None)
+        if bite is None:
+            false_triggers += trigger is not None
+        elif trigger is not None and trigger < bite - LABEL_SLACK:
+            false_triggers += 1
+        else:
+            delays.append((trigger if trigger is not None else end) - bite)
+    mean_delay = sum(delays) / len(delays) if delays else float('inf')
+    return mean_delay, false_triggers / max(len(casts), 1)
+
+
+def calibrate_bites(paths, zone, time_of_day=None, max_false_rate=MAX_FALSE_RATE, save=False):
+    """Pick the bite z-score with the lowest detection delay at a bounded false trigger rate.
+
+    paths are fishing recordings with "cast" and "reel" events (written by
+    the fishing agent when recording) and "bite" labels at the moment fish
+    bite, e.g. from `wowzer.py --record session.wzr simulate fishing`.
+    Casts reeled in on a detected bite but without a label are skipped,
+    their bite time is unknown; casts that timed out count as bite free.
+    """
+    install_input_sink()
+    import main
+    from fishing.bite_detector import BITE_Z_SCORE, bite_profile, save_profile
+    from harness.replay import create_agent
+    from sight.recording import Recording
+
+    main_agent = main.MainAgent()
+    main_agent.zone, main_agent.time = zone, time_of_day
+    fishing = create_agent('fishing', main_agent)
+    profile = bite_profile(zone, time_of_day)
+
+    casts = []
+    skipped = 0
+    for path in paths:
+        recording = Recording(path)
+        for start, bite, end, detected in cast_windows(recording):
+            if bite is None and detected:
+                skipped += 1
+                continue
+            casts.append((bite, end, window_scores(fishing, recording, start, end, profile)))
+        recording.close()
+    bitten = sum(bite is not None for bite, end, scores in casts)
+    print(f"\n===== Bite calibration for {zone} {time_of_day or ''} =====")
+    print(f"{len(casts)} casts ({bitten} with a labelled bite), {skipped} skipped without a label")
+    if not bitten:
+        print("No labelled bites to calibrate on")
+        return None
+
+    results = [(float(z_score),) + evaluate(casts, z_score) for z_score in Z_CANDIDATES]
+    print(f"{'z-score':>8}{'delay s':>10}{'false %':>10}")
+    for z_score, delay, false_rate in results[::4]:
+        print(f"{z_score:>8.1f}{delay:>10.2f}{false_rate * 100:>10.1f}")
+    allowed = [result for result in results if result[2] <= max_false_rate]
+    if not allowed:
+        print(f"No threshold keeps false triggers under {max_false_rate * 100:.0f}%")
+        return None
+    fastest = min(delay for z_score, delay, false_rate in allowed)
+    # Of the thresholds that are as fast, the middle one has the most room
+    # both for weaker splashes and for choppier water than recorded
+    tied = [result for result in allowed if result[1] <= fastest + DELAY_TOLERANCE]
+    best = tied[len(tied) // 2]
+
+    current = profile.get("z_score", BITE_Z_SCORE)
+    delay, false_rate = evaluate(casts, current)
+    print(f"Current: z-score {current:.1f}, {delay:.2f}s mean delay, {false_rate * 100:.1f}% false triggers")
+    z_score, delay, false_rate = best
+    print(f"Best: z-score {z_score:.1f}, {delay:.2f}s mean delay, {false_rate * 100:.1f}% false triggers")
+    if save:
+        save_profile(zone, time_of_day, dict(profile, z_score=z_score))
+        print(f"Saved to the {zone} bite profile")
+    return z_score
@@ -0,0 +1,105 @@
+import sys
+import time
+
+
+class InputSink:
+    """Stand-in for the pyautogui module that logs input instead of sending it.
+
+    Every call is appended to events as a dict with the action name, its
+    arguments and a timestamp, written to the recorder if one is given and
+    passed on to the listeners (e.g. a simulated game reacting to keys).
+    """
+
+    def __init__(self, screen_size=(2560, 1440), recorder=None):
+        self.screen_size = screen_size
+        self.recorder = recorder
+        self.events = []
+        self.listeners = []
+        self._position = (0, 0)
+
+    @staticmethod
+    def easeOutQuad(n):
+        return -n * (n - 2)
+
+    def _log(self, action, *args, **kwargs):
+        event = {
+            "name": action,
+            "args": list(args),
+            "kwargs": kwargs,
+            "timestamp": time.time(),
+            "position": self._position,
+        }
+        self.events.append(event)
+        if self.recorder is not None:
+            self.recorder.write_event("input", timestamp=event["timestamp"], action=action,
+                                      args=[str(a) for a in args], position=self._position)
+        for listener in self.listeners:
+            listener(event)
+
+    def size(self):
+        return self.screen_size
+
+    def position(self):
+        return self._position
+
+    def moveTo(self, x=None, y=None, duration=0.0, tween=None, *args, **kwargs):
+        if x is not None and y is not None:
+            self._position = (int(x), int(y))
+        self._log('moveTo', x, y)
+
+    def move(self, xOffset=0, yOffset=0, *args, **kwargs):
+        self._position = (self._position[0] + int(xOffset), self._position[1] + int(yOffset))
+        self._log('move', xOffset, yOffset)
+
+    def click(self, x=None, y=None, *args, button='left', **kwargs):
+        if x is not None and y is not None:
+            self._position = (int(x), int(y))
+        self._log('click', button=button)
+
+    def rightClick(self, x=None, y=None, *args, **kwargs):
+        if x is not None and y is not None:
+            self._position = (int(x), int(y))
+        self._log('rightClick')
+
+    def press(self, keys, *args, **kwargs):
+        self._log('press', keys)
+
+    def keyDown(self, key, *args, **kwargs):
+        self._log('keyDown', key)
+
+    def keyUp(self, key, *args, **kwargs):
+        self._log('keyUp', key)
+
+    def mouseDown(self, *args, button='left', **kwargs):
+        self._log('mouseDown', button=button)
+
+    def mouseUp(self, *args, button='left', **kwargs):
+        self._log('mouseUp', button=button)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._log(name, *args, **kwargs)
+
+    def summary(self):
+        """Number of logged calls per action"""
+        counts = {}
+        for event in self.events:
+            counts[event["name"]] = counts.get(event["name"], 0) + 1
+        return counts
+
+
+def install_input_sink(sink=None):
+    """Redirect pyautogui to sink, in modules imported later and already imported ones.
+
+    Call this before importing the agents on a headless machine, where the
+    real pyautogui cannot even be imported.
+    """
+    if sink is None:
+        sink = InputSink()
+    real = sys.modules.get('pyautogui')
+    sys.modules['pyautogui'] = sink
+    for module in list(sys.modules.values()):
+        if real is not None and getattr(module, 'pyautogui', None) is real:
+            module.pyautogui = sink
+    return sink
\ No newline at end of file
@@ -0,0 +1,113 @@
+import time
+
+from harness.input_sink import install_input_sink
+from sight.capture import percentile
+
+
+def create_agent(name, main_agent):
+    """Create the fishing or grinding agent by name"""
+    if name == 'fishing':
+        from fishing.fishing_agent import FishingAgent
+        return FishingAgent(main_agent)
+    if name == 'grinding':
+        from grinding.grinding_agent import GrindingAgent
+        return GrindingAgent(main_agent)
+    raise ValueError(f"Unknown agent: {name}")
+
+
+def run_replay(path, agent_name='fishing', speed=1.0, zone=None, time_of_day=None):
+    """Feed a recording into MainAgent and run an agent on it with input logged, not sent.
+
+    Playback starts once the agent runs, without its start delay. The
+    agents' own waits and timeouts stay in real time, so only speed 1
+    replays a session as it happened; other speeds are for quick runs of
+    the vision code, with the agent seeing fewer frames per state.
+    """
+    sink = install_input_sink()
+    import main
+    from sight.recording import RecordingCapture
+
+    main_agent = main.MainAgent()
+    main_agent.capture_backend = RecordingCapture(path, speed=speed, paused=True)
+    # A recording's UI must not replace the layout saved for the live game
+    main_agent.layout_path = None
+    sink.screen_size = main_agent.capture_backend.size()
+    if zone is not None:
+        main_agent.zone = zone
+    if time_of_day is not None:
+        main_agent.time = time_of_day
+
+    main_agent.start_capture()
+    main_agent.wait_for_frame(0)
+    if speed != 1:
+        print(f"Replaying at speed {speed}: the agent's waits and timeouts still run in real time")
+
+    start = time.time()
+    agent = create_agent(agent_name, main_agent)
+    agent.run(start_delay=0)
+    main_agent.capture_backend.play()
+    main_agent.update_screen_thread.join()
+    elapsed = time.time() - start
+
+    print(f"\n===== Replay of {path} =====")
+    print(f"Frames: {main_agent.frames.last_id} in {elapsed:.1f}s at speed {speed}")
+    for action, count in sorted(sink.summary().items()):
+        print(f"{action}: {count}")
+    return sink
+
+
+def time_call(function, *args):
+    t0 = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - t0, result
+
+
+def print_timings(name, timings):
+    if not timings:
+        print(f"{name:<14}no samples")
+        return
+    print(f"{name:<14}{len(timings):>8}{sum(timings) / len(timings) * 1000:>10.2f}"
+          f"{percentile(timings, 50) * 1000:>10.2f}{percentile(timings, 99) * 1000:>10.2f}")
+
+
+def bench_vision(path, zone=None, time_of_day=None):
+    """Time find_lure, watch_lure's bite check and find_target on every frame of a recording"""
+    install_input_sink()
+    import main
+    from fishing.bite_detector import BiteDetector, bite_profile
+    from sight.recording import Recording
+
+    recording = Recording(path)
+    main_agent = main.MainAgent()
+    if zone is not None:
+        main_agent.zone = zone
+    if time_of_day is not None:
+        main_agent.time = time_of_day
+    fishing = create_agent('fishing', main_agent)
+    grinding = create_agent('grinding', main_agent)
+
+    timings = {"find_lure": [], "watch_lure": [], "find_target": []}
+    bite_detector = BiteDetector(**bite_profile(main_agent.zone, main_agent.time))
+    watched = None
+    for index, entry in enumerate(recording.frames):
+        frame = main_agent.frames.publish(recording.image(index), entry.color_order, entry.timestamp)
+        elapsed, (location, confidence) = time_call(fishing.locate_lure, frame)
+        timings["find_lure"].append(elapsed)
+        if location is not None:
+            if location != watched:
+                bite_detector.start(location, fishing.fishing_target.shape[1::-1])
+                watched = location
+            elapsed, _ = time_call(bite_detector.update, frame)
+            timings["watch_lure"].append(elapsed)
+        # A full scan every frame: no "nothing changed since the last scan"
+        # shortcut and no tracker re-find from the previous frame's target
+        grinding.last_frame_id = 0
+        grinding.target_tracker = None
+        elapsed, _ = time_call(grinding.find_target)
+        timings["find_target"].append(elapsed)
+
+    print(f"\n===== Vision benchmark over {len(recording)} frames of {path} =====")
+    print(f"{'function':<14}{'calls':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, values in timings.items():
+        print_timings(name, values)
+    return timings
@@ -0,0 +1,329 @@
+import os
+import random
+import time
+from threading import Lock
+
+import numpy as np
+import cv2 as cv
+
+from harness.input_sink import InputSink, install_input_sink
+from sight.capture import CaptureBackend
+
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+ASSETS = {
+    "bobber": os.path.join(SRC_PATH, "fishing", "assets", "fishing_target.png"),
+    "wolf": os.path.join(SRC_PATH, "grinding", "assets", "enemies", "Young_Wolf.PNG"),
+    "health_bar": os.path.join(SRC_PATH, "grinding", "assets", "ui", "health_bar.PNG"),
+    "player_frame": os.path.join(SRC_PATH, "grinding", "assets", "ui", "in_combat.PNG"),
+    "loot": os.path.join(SRC_PATH, "grinding", "assets", "ui", "loot.PNG"),
+}
+
+# Zone the fishing scenario plays in; the splash drawn on a bite stands out
+# clearly from the water around the bobber
+FISHING_ZONE = ("Feralas", "day")
+WATER_BGR = (60, 95, 80)
+SPLASH_BGR = (235, 205, 170)
+GROUND_BGR = (45, 80, 95)
+
+# Fishing timings in seconds
+CAST_DELAY = 1.5              # Cast animation before the bobber lands
+BITE_DELAY = (4.0, 15.0)      # Random wait between landing and the bite
+SPLASH_DURATION = 2.0         # Window in which right-clicking catches the fish
+
+# Grinding scenario
+WOLF_SPAWNS = [(0.15, 0.2), (0.55, 0.25), (0.35, 0.45)]  # Top-left corners as screen fractions
+WOLF_HEALTH = 100
+SHOT_DAMAGE = 35
+RESPAWN_DELAY = 8.0
+CLICK_RADIUS = 40             # How far from an object a click still hits it
+
+# Unit frames, laid out as sight.ui_state.UI_LAYOUT expects them (top-left corners)
+PLAYER_FRAME_POS = (10, 10)
+HEALTH_BAR_POS = (136, 59)
+MANA_BAR_POS = (136, 83)
+TARGET_HEALTH_POS = (526, 59)
+# Columns of the bar image holding the coloured fill, and the colour of its empty part
+BAR_FILL_COLUMNS = (7, 202)
+EMPTY_BAR_BGR = (20, 20, 20)
+# Round minimap: centre measured from the top-right corner of the screen, and radius
+MINIMAP_OFFSET = (110, 105)
+MINIMAP_RADIUS = 80
+MINIMAP_BGR = (50, 90, 60)
+MINIMAP_BORDER_BGR = (150, 160, 170)
+
+
+def load_asset(name):
+    image = cv.imread(ASSETS[name])
+    if image is None:
+        raise FileNotFoundError(ASSETS[name])
+    return image
+
+
+class Wolf:
+    def __init__(self, position):
+        self.position = position
+        self.health = WOLF_HEALTH
+        self.dead_time = None
+        self.looted = False
+
+
+class GameSimulator(CaptureBackend):
+    """Headless stand-in for the game client.
+
+    Renders frames with the project's own templates at scripted positions
+    and reacts to the input the agents send through an InputSink: '1' casts
+    (or shoots the current target), 'esc' clears the target, right-click
+    reels in, targets or loots.
+    It counts what happened so casts/hour and kills/hour can be measured.
+    With a recorder, the moment of every bite is written to the recording
+    as a "bite" label for `wowzer.py calibrate-bites`.
+    """
+    name = "simulator"
+    color_order = "BGR"
+
+    def __init__(self, scenario='fishing', screen_size=(1920, 1080), seed=None, recorder=None):
+        self.scenario = scenario
+        self.recorder = recorder
+        self.width, self.height = screen_size
+        self.random = random.Random(seed)
+        self.assets = {name: load_asset(name) for name in ASSETS}
+        # Out of combat the name plate is not red
+        self.assets["player_frame_idle"] = cv.cvtColor(
+            cv.cvtColor(self.assets["player_frame"], cv.COLOR_BGR2GRAY), cv.COLOR_GRAY2BGR)
+        # The mana bar is the health bar in blue
+        self.assets["mana_bar"] = self.assets["health_bar"][:, :, [1, 0, 2]].copy()
+        self._lock = Lock()
+        self._frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self._background = self._draw_background()
+        self.start_time = time.time()
+
+        # Fishing state
+        self.cast_time = None
+        self.bobber = None
+        self.bite_time = None
+        self.bite_labelled = False
+
+        # Grinding state
+        self.wolves = []
+        if scenario == 'grinding':
+            self.wolves = [Wolf(self._fraction_to_pixels(pos)) for pos in WOLF_SPAWNS]
+        self.target = None
+        self.player_health = 1.0
+        self.in_combat = False
+
+        self.stats = {"casts": 0, "catches": 0, "missed": 0, "early_reels": 0,
+                      "kills": 0, "loots": 0, "shots": 0}
+
+    def _fraction_to_pixels(self, fractions):
+        return (int(fractions[0] * self.width), int(fractions[1] * self.height))
+
+    def _draw_background(self):
+        background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        horizon = self.height // 3
+        background[:horizon] = GROUND_BGR
+        background[horizon:] = WATER_BGR
+        noise = np.random.default_rng(0).integers(-6, 7, background.shape)
+        background = np.clip(background.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        center = (self.width - MINIMAP_OFFSET[0], MINIMAP_OFFSET[1])
+        cv.circle(background, center, MINIMAP_RADIUS, MINIMAP_BGR, -1)
+        cv.circle(background, center, MINIMAP_RADIUS, MINIMAP_BORDER_BGR, 4)
+        return background
+
+    def attach(self, sink):
+        """React to the input logged by sink"""
+        sink.screen_size = (self.width, self.height)
+        sink.listeners.append(self.on_input)
+
+    # Input handling, called from the agent threads
+
+    def on_input(self, event):
+        with self._lock:
+            now = time.time()
+            if event["name"] == "press" and event["args"] and event["args"][0] == '1':
+                self._press_1(now)
+            elif event["name"] == "press" and event["args"] and event["args"][0] == 'esc':
+                self.target = None
+            elif event["name"] == "rightClick" or (
+                    event["name"] == "click" and event["kwargs"].get("button") == "right"):
+                self._right_click(now, event["position"])
+
+    def _press_1(self, now):
+        if self.target is not None:
+            wolf = self.target
+            if wolf.dead_time is not None:
+                return
+            wolf.health -= SHOT_DAMAGE
+            self.stats["shots"] += 1
+            self.in_combat = True
+            if wolf.health <= 0:
+                # Like the game, the dead wolf stays targeted with an empty health bar
+                wolf.dead_time = now
+                self.in_combat = False
+                self.stats["kills"] += 1
+        elif self.cast_time is None and self.bobber is None:
+            self.cast_time = now
+            self.stats["casts"] += 1
+
+    def _right_click(self, now, position):
+        if self.bobber is not None and self._near(position, self.bobber, (17, 35)):
+            if self.bite_time is not None and now >= self.bite_time:
+                self.stats["catches"] += 1
+            else:
+                self.stats["early_reels"] += 1
+            self.bobber = None
+            self.bite_time = None
+            return
+
+        for wolf in self.wolves:
+            h, w = self.assets["wolf"].shape[:2]
+            if wolf.dead_time is None and self._near(position, wolf.position, (w, h)):
+                self.target = wolf
+                return
+            if wolf.dead_time is not None and not wolf.looted and self._near(position, self._loot_pos(wolf), (29, 32)):
+                wolf.looted = True
+                self.stats["loots"] += 1
+                return
+
+    def _near(self, position, top_left, size):
+        x, y = position
+        left, top = top_left
+        return (left - CLICK_RADIUS <= x <= left + size[0] + CLICK_RADIUS and
+                top - CLICK_RADIUS <= y <= top + size[1] + CLICK_RADIUS)
+
+    def _loot_pos(self, wolf):
+        h, w = self.assets["wolf"].shape[:2]
+        return (wolf.position[0] + w // 2, wolf.position[1] + h // 2)
+
+    # World update and rendering, called from the capture thread
+
+    def _update(self, now):
+        if self.cast_time is not None and now - self.cast_time >= CAST_DELAY:
+            self.cast_time = None
+            left = int(self.width * self.random.uniform(0.3, 0.7))
+            top = int(self.height * self.random.uniform(0.4, 0.7))
+            self.bobber = (left, top)
+            self.bite_time = now + self.random.uniform(*BITE_DELAY)
+            self.bite_labelled = False
+        if self.bite_time is not None and now >= self.bite_time and not self.bite_labelled:
+            self.bite_labelled = True
+            if self.recorder is not None:
+                self.recorder.write_event("bite", timestamp=self.bite_time)
+        if self.bite_time is not None and now > self.bite_time + SPLASH_DURATION:
+            # The fish got away
+            self.stats["missed"] += 1
+            self.bobber = None
+            self.bite_time = None
+
+        for i, wolf in enumerate(self.wolves):
+            if wolf.dead_time is not None and now - wolf.dead_time >= RESPAWN_DELAY:
+                spawn = self.random.choice(WOLF_SPAWNS)
+                self.wolves[i] = Wolf(self._fraction_to_pixels(spawn))
+
+    def _paste(self, image, position):
+        x, y = position
+        h, w = image.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        if x1 > x0 and y1 > y0:
+            self._frame[y0:y1, x0:x1] = image[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    def _render(self, now):
+        np.copyto(self._frame, self._background)
+
+        for wolf in self.wolves:
+            if wolf.dead_time is None:
+                self._paste(self.assets["wolf"], wolf.position)
+            elif not wolf.looted:
+                # Corpse: darkened wolf with the loot sparkle on top
+                self._paste(self.assets["wolf"] // 3, wolf.position)
+                self._paste(self.assets["loot"], self._loot_pos(wolf))
+
+        if self.bobber is not None:
+            x, y = self.bobber
+            if self.bite_time is not None and now >= self.bite_time:
+                cv.ellipse(self._frame, (x + 8, y + 25), (22, 14), 0, 0, 360, SPLASH_BGR, -1)
+            self._paste(self.assets["bobber"], self.bobber)
+
+        self._paste(self.assets["player_frame" if self.in_combat else "player_frame_idle"], PLAYER_FRAME_POS)
+        self._draw_bar("health_bar", self.player_health, HEALTH_BAR_POS)
+        self._draw_bar("mana_bar", 1.0, MANA_BAR_POS)
+        if self.target is not None:
+            self._draw_bar("health_bar", max(self.target.health, 0) / WOLF_HEALTH, TARGET_HEALTH_POS)
+
+    def _draw_bar(self, name, fraction, position):
+        bar = self.assets[name].copy()
+        left, right = BAR_FILL_COLUMNS
+        bar[:, left + int((right - left) * fraction):right] = EMPTY_BAR_BGR
+        self._paste(bar, position)
+
+    # CaptureBackend
+
+    def size(self):
+        return (self.width, self.height)
+
+    def begin_frame(self):
+        now = time.time()
+        with self._lock:
+            self._update(now)
+            self._render(now)
+
+    def grab(self, bbox=None):
+        if bbox is None:
+            return self._frame
+        left, top, right, bottom = bbox
+        return self._frame[top:bottom, left:right]
+
+    def report(self):
+        """Counters plus casts, catches and kills per hour of simulated play"""
+        hours = max(time.time() - self.start_time, 1e-6) / 3600
+        report = dict(self.stats)
+        report["elapsed_s"] = hours * 3600
+        report["casts_per_hour"] = self.stats["casts"] / hours
+        report["catches_per_hour"] = self.stats["catches"] / hours
+        report["kills_per_hour"] = self.stats["kills"] / hours
+        return report
+
+
+def run_simulation(agent_name='fishing', duration=300, screen_size=(1920, 1080), seed=None, recorder=None):
+    """Run an agent against the simulator for duration seconds and print its throughput.
+
+    With a sight.recording.FrameRecorder the session is recorded, input and
+    bite labels included.
+    """
+    sink = install_input_sink(InputSink(screen_size, recorder))
+    import main
+    from harness.replay import create_agent
+
+    simulator = GameSimulator(agent_name, screen_size, seed, recorder)
+    simulator.attach(sink)
+    main_agent = main.MainAgent()
+    main_agent.capture_backend = simulator
+    main_agent.recorder = recorder
+    # The simulator's UI must not replace the layout saved for the game
+    main_agent.layout_path = None
+    main_agent.zone, main_agent.time = FISHING_ZONE
+
+    main_agent.start_capture()
+    main_agent.wait_for_frame(0)
+
+    simulator.start_time = time.time()
+    agent = create_agent(agent_name, main_agent)
+    agent.run(start_delay=0)
+    time.sleep(max(0, duration - (time.time() - simulator.start_time)))
+    if agent_name == 'fishing':
+        agent.stop_fishing()
+    else:
+        agent.stop_grinding()
+    sink.recorder = None
+    # Closes the recorder once the last frame is written
+    main_agent.stop_capture()
+
+    report = simulator.report()
+    print(f"\n===== Simulated {agent_name} for {report['elapsed_s']:.0f}s =====")
+    for key, value in report.items():
+        if isinstance(value, float):
+            print(f"{key}: {value:.1f}")
+        else:
+            print(f"{key}: {value}")
+    return report
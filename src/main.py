@@ -1,15 +1,25 @@
-from PIL import Image, ImageGrab
 import time
 from threading import Thread
-import numpy as np
-import cv2 as cv    
 
 import sight.mana_bar as mana_bar
+from sight.regions import CaptureRegions
+from sight.capture import PILCapture
+from sight.frame_store import FrameStore
+from sight.change_detector import ChangeDetector
+from sight.stats import MemoryReport
+from sight.pacing import FramePacer, FpsMeter
+from sight.executor import VisionExecutor
+from sight.ui_state import UIStateReader
+from sight.ui_layout import LAYOUT_PATH, load_layout
 import fishing.fishing_agent as fishing_agent
 import grinding.grinding_agent as grinding_agent
 
 
 FPS_REPORT_DELAY = 3
+# Seconds between attempts to find the UI while it is not on screen
+LAYOUT_RETRY_DELAY = 2
+# Seconds to wait for the capture thread to finish its frame when stopping
+CAPTURE_STOP_TIMEOUT = 5
 
 
 class MainAgent:
@@ -17,9 +27,38 @@ class MainAgent:
         self.agents = []
         self.fishing_thread = None
         self.grinding_thread = None
+        self.update_screen_thread = None
+        # Set by start_capture(), cleared to end the update_screen loop
+        self.capturing = False
 
-        self.cur_img = None
-        self.cur_imgHSV = None
+        # Captured frames, read the latest one with frames.latest()
+        self.frames = FrameStore(change_detector=ChangeDetector())
+
+        # Screen capture mode: "full" grabs the whole desktop, "roi" only grabs
+        # the regions registered by the agents in capture_regions
+        self.capture_mode = "full"
+        self.capture_regions = CaptureRegions()
+        # Screen capture source, see sight.capture (defaults to PIL ImageGrab)
+        self.capture_backend = None
+        # Capture frame rate, agents raise it with request_fps() while they need it
+        self.pacer = FramePacer()
+        # Optional sight.recording.FrameRecorder that every captured frame is written to
+        self.recorder = None
+        # Optional sight.frame_bus.FrameBus that shares every frame with other processes
+        self.frame_bus = None
+        # Worker threads the agents spread their template searches over
+        self.vision = VisionExecutor()
+        # Health, mana, target health and combat flag of the latest frame, a
+        # sight.ui_state.UIState the capture thread reads once per frame
+        self.ui_reader = UIStateReader()
+        self.ui_state = None
+        self.capture_regions.register("ui_state", self.ui_reader.bounds)
+        # Where the UI elements are, a sight.ui_layout.UILayout found once an
+        # agent starts (the game is on screen by then). Layouts are saved to
+        # layout_path, None to neither read nor save them (harness runs)
+        self.ui_layout = None
+        self.layout_path = LAYOUT_PATH
+        self._layout_thread = None
 
         self.zone = "Elwynn Forest"
         self.time = "day"
@@ -29,56 +68,191 @@ class MainAgent:
         self.character_level = 1         # Default level
         self.character_race = "Human"     # Default race
 
+    def discover_layout(self, refresh=False):
+        """Find the UI layout in a background thread, retrying until the unit frames show up.
+
+        Nothing to do once they were found, unless refresh asks to ignore
+        the saved layouts and search again (after moving or scaling the UI).
+        """
+        if self._layout_thread is not None and self._layout_thread.is_alive():
+            return
+        if not refresh and self.ui_layout is not None and "unit_frames" in self.ui_layout.found:
+            return
+        self._layout_thread = Thread(
+            target=self._discover_layout, args=(refresh,), name="layout thread", daemon=True)
+        self._layout_thread.start()
+
+    def _discover_layout(self, refresh):
+        warned = False
+        while True:
+            with self.frames.hold() as frame:
+                layout = load_layout(frame, refresh, self.layout_path) if frame is not None else None
+            if layout is not None and "unit_frames" in layout.found:
+                self.use_layout(layout)
+                return
+            if not warned:
+                print("Player frame not found, using the default UI layout until it shows up")
+                warned = True
+            time.sleep(LAYOUT_RETRY_DELAY)
+
+    def use_layout(self, layout):
+        """Read the unit frames where layout has them"""
+        self.ui_layout = layout
+        self.ui_reader = UIStateReader(layout.state_regions())
+        self.capture_regions.register("ui_state", self.ui_reader.bounds)
+
+    def start_capture(self):
+        self.capturing = True
+        self.update_screen_thread = Thread(
+            target=update_screen,
+            args=(self,),
+            name="update screen thread",
+            daemon=True)
+        self.update_screen_thread.start()
+
+    def stop_capture(self):
+        """End the capture loop and wait for its thread, then close the recorder and frame bus.
+
+        They are only closed once no frame can be written to them any more.
+        """
+        self.capturing = False
+        thread = self.update_screen_thread
+        if thread is not None:
+            thread.join(CAPTURE_STOP_TIMEOUT)
+            if thread.is_alive():
+                print("WARNING: Screen capture did not stop, leaving the recorder and frame bus open")
+                return
+        self.close_outputs()
+
+    def close_outputs(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+        frame_bus, self.frame_bus = self.frame_bus, None
+        if frame_bus is not None:
+            frame_bus.close()
+
+    def request_fps(self, owner, fps):
+        """Ask the capture thread for at least fps frames per second on behalf of owner"""
+        self.pacer.request(owner, fps)
+
+    def release_fps(self, owner):
+        self.pacer.release(owner)
+
+    def wait_for_frame(self, after_id=None, timeout=None):
+        """Block until a frame newer than after_id is captured (None on timeout)"""
+        return self.frames.wait_for_frame(after_id, timeout)
+
 
 def update_screen(agent):
     print("Starting computer vision screen update...")
     
+    if agent.capture_backend is None:
+        agent.capture_backend = PILCapture()
+    backend = agent.capture_backend
+    print("Capture backend: " + backend.name)
+
     # Get screen resolution
-    import pyautogui
-    width, height = pyautogui.size()
+    width, height = backend.size()
     print("Detected display resolution: " + str(width) + " x " + str(height))
 
-    loop_time = time.time()
+    shape = (height, width, backend.channels)
+    memory = MemoryReport(agent.frames)
+    fps_meter = FpsMeter()
+    frames_since_report = 0
+
     fps_print_time = time.time()
-    while True:
-        screenshot = ImageGrab.grab()
-        screenshot = np.array(screenshot)
-        screenshot = cv.cvtColor(screenshot, cv.COLOR_RGB2BGR)
-        screenshotHSV = cv.cvtColor(screenshot, cv.COLOR_BGR2HSV)
-        agent.cur_img = screenshot
-        agent.cur_imgHSV = screenshotHSV
-
-        cur_time = time.time()
+    while agent.capturing:
+        regions = None
+        if agent.capture_mode == "roi":
+            regions = agent.capture_regions.merged((width, height))
+
+        # Grab straight into the frame store's preallocated back buffer.
+        # Colour conversions are left to the consumers, see sight.frame_store.Frame
+        tag = tuple(regions) if regions else None
+        screenshot, previous_tag = agent.frames.back_buffer(shape, tag)
+        try:
+            backend.begin_frame()
+        except EOFError as e:
+            print(f"Screen capture stopped: {e}")
+            break
+        if regions:
+            if previous_tag != tag:
+                # Clear what earlier, different regions left in this buffer
+                screenshot.fill(0)
+            grab_regions(backend, regions, screenshot)
+        else:
+            backend.grab_into(screenshot)
+        frame = agent.frames.publish(screenshot, backend.color_order)
+        agent.ui_state = agent.ui_reader.read(frame)
+        if agent.recorder is not None:
+            agent.recorder.write_frame(frame)
+        if agent.frame_bus is not None:
+            agent.frame_bus.publish(frame)
+        fps_meter.tick()
+        frames_since_report += 1
+
+        cur_time = frame.timestamp
         if cur_time - fps_print_time >= FPS_REPORT_DELAY:
-            print('FPS: {}'.format(1 / (cur_time - loop_time)))
+            print('FPS: {:.1f} (target {}, jitter {:.1f} ms) | {}'.format(
+                fps_meter.fps(), agent.pacer.target_fps, fps_meter.jitter() * 1000,
+                memory.report(frames_since_report)))
             fps_print_time = cur_time
-        loop_time = cur_time
-        cv.waitKey(1)
+            frames_since_report = 0
+        if not backend.self_paced:
+            agent.pacer.wait()
+
+    if agent.capturing:
+        # The capture source ran out, nothing else stops the recording
+        agent.capturing = False
+        agent.close_outputs()
+
+def grab_regions(backend, regions, screenshot):
+    """Grab only the given screen regions into a full-size canvas.
+
+    Pixels outside the regions are left untouched so consumers can keep
+    using screen coordinates.
+    """
+    for left, top, right, bottom in regions:
+        backend.grab_into(screenshot[top:bottom, left:right], (left, top, right, bottom))
+    return screenshot
 
 def print_menu():
     print('Enter a command:')
     print('\tS\tStart main AI agent screen capture.')
+    print('\tR\tToggle region-of-interest screen capture.')
+    print('\tL\tFind the UI layout again (after moving or scaling the UI).')
     print('\tZ\tSet zone')
     print('\tF\tStart fishing.')
     print('\tG\tStart grinding/farming.')
     print('\tC\tSet character class.')
     print('\tQ\tQuit wowzer.')
 
-def run():
+def run(capture_backend=None, recorder=None, frame_bus=None):
     main_agent = MainAgent()
+    main_agent.capture_backend = capture_backend
+    main_agent.recorder = recorder
+    main_agent.frame_bus = frame_bus
 
+    agent = None
     print_menu()
     while True:
         user_input = input()
         user_input = str.lower(user_input).strip()
 
         if user_input == 's':
-            update_screen_thread = Thread(
-                target=update_screen, 
-                args=(main_agent,), 
-                name="update screen thread",
-                daemon=True)
-            update_screen_thread.start()
+            main_agent.start_capture()
+
+        elif user_input == 'r':
+            if main_agent.capture_mode == "full":
+                main_agent.capture_mode = "roi"
+            else:
+                main_agent.capture_mode = "full"
+            print(f"Screen capture mode set to: {main_agent.capture_mode}")
+
+        elif user_input == 'l':
+            print("Finding the UI layout again...")
+            main_agent.discover_layout(refresh=True)
 
         elif user_input == 'f':        
             agent = fishing_agent.FishingAgent(main_agent)
@@ -114,6 +288,11 @@ def run():
 
         elif user_input == 'q':
             print("Shutting down wowzer.")
+            if isinstance(agent, fishing_agent.FishingAgent):
+                agent.stop_fishing()
+            elif isinstance(agent, grinding_agent.GrindingAgent):
+                agent.stop_grinding()
+            main_agent.stop_capture()
             break       
         
         else:
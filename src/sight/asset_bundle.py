@@ -0,0 +1,139 @@
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from sight.matching import PYRAMID_LEVELS
+from sight.templates import IMAGE_EXTENSIONS, Template, TemplateRegistry
+
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# Directories compiled into the bundle, searched recursively (zone folders included)
+ASSET_DIRS = [
+    os.path.join(SRC_PATH, "fishing", "assets"),
+    os.path.join(SRC_PATH, "grinding", "assets"),
+]
+# Where build-assets writes the bundle and where the registry looks for it
+BUNDLE_PATH = os.path.join(SRC_PATH, "assets.wzb")
+
+# File layout: BUNDLE_MAGIC, index size, UTF-8 JSON index, then the raw
+# arrays, each starting on an ARRAY_ALIGN boundary. Every index entry holds
+# the source file's size and mtime, so a changed PNG is read from disk again.
+BUNDLE_MAGIC = b'WZAST001'
+INDEX_SIZE = struct.Struct('<Q')
+ARRAY_ALIGN = 64
+
+
+def bundle_key(path):
+    """Index key of an asset: its path relative to src, lower case"""
+    return os.path.relpath(os.path.abspath(path), SRC_PATH).replace(os.sep, '/').lower()
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def find_assets(directories=None):
+    """Every template image below the asset directories"""
+    paths = []
+    for directory in directories or ASSET_DIRS:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, filename))
+    return paths
+
+
+def build_bundle(output=BUNDLE_PATH, directories=None):
+    """Decode every asset once and write it with its precomputed variants into one bundle file"""
+    start = time.perf_counter()
+    loader = TemplateRegistry(use_bundle=False)
+    arrays = []
+    index = {}
+    offset = 0
+
+    def add(array):
+        nonlocal offset
+        array = np.ascontiguousarray(array)
+        offset += -offset % ARRAY_ALIGN
+        entry = {"offset": offset, "shape": list(array.shape), "dtype": array.dtype.str}
+        arrays.append((offset, array))
+        offset += array.nbytes
+        return entry
+
+    for path in find_assets(directories):
+        template = loader.get(path)
+        if template is None:
+            continue
+        index[bundle_key(path)] = {
+            "name": template.name,
+            "source": _source_stamp(path),
+            "image": add(template.image),
+            "gray": add(template.gray),
+            "mask": None if template.mask is None else add(template.mask),
+            "mean": template.mean.tolist(),
+            "std": template.std.tolist(),
+            "levels": PYRAMID_LEVELS,
+            "pyramid": [add(level) for level in template.pyramid(1.0, PYRAMID_LEVELS)],
+        }
+
+    header = json.dumps(index).encode()
+    data_start = len(BUNDLE_MAGIC) + INDEX_SIZE.size + len(header)
+    data_start += -data_start % ARRAY_ALIGN
+    with open(output, 'wb') as bundle:
+        bundle.write(BUNDLE_MAGIC)
+        bundle.write(INDEX_SIZE.pack(len(header)))
+        bundle.write(header)
+        for array_offset, array in arrays:
+            bundle.seek(data_start + array_offset)
+            bundle.write(memoryview(array).cast('B'))
+    print(f"Bundled {len(index)} templates into {output} "
+          f"({os.path.getsize(output) / 1e6:.1f} MB) in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return output
+
+
+class AssetBundle:
+    """Memory-mapped template bundle written by build_bundle().
+
+    Templates come out as zero-copy views into the mapped file, with their
+    grayscale version, mask, statistics and full-scale pyramid already
+    filled in, so nothing has to be decoded or recomputed at startup.
+    """
+
+    def __init__(self, path=BUNDLE_PATH):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not a wowzer asset bundle")
+        header_start = len(BUNDLE_MAGIC) + INDEX_SIZE.size
+        header_size = INDEX_SIZE.unpack_from(self._map, len(BUNDLE_MAGIC))[0]
+        self.index = json.loads(bytes(self._map[header_start:header_start + header_size]))
+        self._data_start = header_start + header_size
+        self._data_start += -self._data_start % ARRAY_ALIGN
+
+    def __len__(self):
+        return len(self.index)
+
+    def _array(self, entry):
+        if entry is None:
+            return None
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"]))
+        return np.frombuffer(self._map, dtype=dtype, count=count,
+                             offset=self._data_start + entry["offset"]).reshape(entry["shape"])
+
+    def template(self, path):
+        """Template for the asset file at path, or None if it is not bundled or changed since"""
+        entry = self.index.get(bundle_key(path))
+        if entry is None or entry["source"] != _source_stamp(path):
+            return None
+        return Template.from_arrays(
+            entry["name"], path, self._array(entry["image"]), self._array(entry["gray"]),
+            self._array(entry["mask"]), np.array(entry["mean"]), np.array(entry["std"]),
+            {(1.0, entry["levels"]): [self._array(level) for level in entry["pyramid"]]})
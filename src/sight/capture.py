@@ -0,0 +1,454 @@
+import ctypes
+import ctypes.util
+import os
+import time
+
+import numpy as np
+import cv2 as cv
+
+
+# cv.cvtColor codes converting each backend's native colour order to BGR
+TO_BGR = {
+    "RGB": cv.COLOR_RGB2BGR,
+    "BGRA": cv.COLOR_BGRA2BGR,
+    "BGR": None,
+}
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def to_bgr(image, color_order, dst=None):
+    """Convert an image grabbed by a backend to BGR"""
+    code = TO_BGR[color_order]
+    if code is None:
+        if dst is None:
+            return image
+        np.copyto(dst, image)
+        return dst
+    if dst is None:
+        return cv.cvtColor(image, code)
+    return cv.cvtColor(image, code, dst=dst)
+
+
+class CaptureBackend:
+    """Base class for screen capture sources.
+
+    grab() returns a uint8 array of shape (height, width, channels) in the
+    colour order given by color_order. bbox is (left, top, right, bottom)
+    in source coordinates, None grabs the whole source. grab_into() writes
+    into a preallocated array instead; backends override it when they can
+    avoid the intermediate allocation.
+
+    begin_frame() is called once per captured frame, before the grabs for
+    that frame, so file based sources advance once even when several ROI
+    regions are grabbed. Backends that set self_paced deliver frames at
+    their own rate and are not throttled by the capture loop.
+    """
+    name = "base"
+    color_order = "RGB"
+    channels = 3
+    self_paced = False
+
+    def size(self):
+        raise NotImplementedError
+
+    def begin_frame(self):
+        pass
+
+    def grab(self, bbox=None):
+        raise NotImplementedError
+
+    def grab_into(self, dst, bbox=None):
+        """Grab into dst, a uint8 array of shape (height, width, channels)"""
+        np.copyto(dst, self.grab(bbox))
+        return dst
+
+    def close(self):
+        pass
+
+
+class PILCapture(CaptureBackend):
+    """Desktop capture through PIL ImageGrab"""
+    name = "pil"
+    color_order = "RGB"
+
+    def __init__(self):
+        from PIL import ImageGrab
+        self._grab = ImageGrab.grab
+        self._size = None
+
+    def size(self):
+        if self._size is None:
+            self._size = self._grab().size
+        return self._size
+
+    def grab(self, bbox=None):
+        image = np.asarray(self._grab(bbox=bbox))
+        return image[:, :, :3]
+
+
+class _XImage(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("xoffset", ctypes.c_int),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int),
+        ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+        ("red_mask", ctypes.c_ulong),
+        ("green_mask", ctypes.c_ulong),
+        ("blue_mask", ctypes.c_ulong),
+        ("obdata", ctypes.c_void_p),
+        ("funcs", ctypes.c_void_p * 6),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class _XWindowAttributes(ctypes.Structure):
+    _fields_ = [
+        ("x", ctypes.c_int),
+        ("y", ctypes.c_int),
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("border_width", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("visual", ctypes.c_void_p),
+        ("root", ctypes.c_ulong),
+        ("class_", ctypes.c_int),
+        ("bit_gravity", ctypes.c_int),
+        ("win_gravity", ctypes.c_int),
+        ("backing_store", ctypes.c_int),
+        ("backing_planes", ctypes.c_ulong),
+        ("backing_pixel", ctypes.c_ulong),
+        ("save_under", ctypes.c_int),
+        ("colormap", ctypes.c_ulong),
+        ("map_installed", ctypes.c_int),
+        ("map_state", ctypes.c_int),
+        ("all_event_masks", ctypes.c_long),
+        ("your_event_mask", ctypes.c_long),
+        ("do_not_propagate_mask", ctypes.c_long),
+        ("override_redirect", ctypes.c_int),
+        ("screen", ctypes.c_void_p),
+    ]
+
+
+class X11ShmCapture(CaptureBackend):
+    """Capture of a single X11 window through the MIT shared memory extension.
+
+    The X server writes each frame straight into a shared memory segment, so
+    a grab costs one copy out of that segment. Pass window_name (matched
+    against the window title) or window_id, otherwise the root window is used.
+    """
+    name = "x11shm"
+    color_order = "BGRA"
+    channels = 4
+
+    _ZPIXMAP = 2
+    _ALL_PLANES = ctypes.c_ulong(-1)
+    _IPC_PRIVATE = 0
+    _IPC_CREAT = 0o1000
+    _IPC_RMID = 0
+
+    def __init__(self, window_name=None, window_id=None):
+        xlib_path = ctypes.util.find_library('X11')
+        xext_path = ctypes.util.find_library('Xext')
+        if xlib_path is None or xext_path is None:
+            raise RuntimeError("libX11 / libXext not found")
+        self._xlib = ctypes.CDLL(xlib_path)
+        self._xext = ctypes.CDLL(xext_path)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._declare_functions()
+
+        self._display = self._xlib.XOpenDisplay(None)
+        if not self._display:
+            raise RuntimeError("Cannot open X display (is DISPLAY set?)")
+        if not self._xext.XShmQueryExtension(self._display):
+            self._xlib.XCloseDisplay(self._display)
+            raise RuntimeError("X server does not support the MIT-SHM extension")
+
+        root = self._xlib.XDefaultRootWindow(self._display)
+        if window_id is not None:
+            self._window = window_id
+        elif window_name is not None:
+            self._window = self._find_window(root, window_name)
+            if self._window is None:
+                self._xlib.XCloseDisplay(self._display)
+                raise RuntimeError(f"No X11 window named {window_name!r}")
+        else:
+            self._window = root
+
+        self._attrs = _XWindowAttributes()
+        self._xlib.XGetWindowAttributes(self._display, self._window, ctypes.byref(self._attrs))
+        # One shared memory image per grab size, so ROI grabs only transfer their own pixels
+        self._images = {}
+
+    def _declare_functions(self):
+        xlib, xext, libc = self._xlib, self._xext, self._libc
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XGetWindowAttributes.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XWindowAttributes)]
+        xlib.XFetchName.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_char_p)]
+        xlib.XQueryTree.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong,
+            ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(ctypes.POINTER(ctypes.c_ulong)), ctypes.POINTER(ctypes.c_uint)]
+        xlib.XFree.argtypes = [ctypes.c_void_p]
+        xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+            ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+            ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.restype = ctypes.c_int
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def _find_window(self, window, window_name):
+        name = ctypes.c_char_p()
+        if self._xlib.XFetchName(self._display, window, ctypes.byref(name)) and name.value:
+            found = name.value.decode(errors='replace') == window_name
+            self._xlib.XFree(name)
+            if found:
+                return window
+        root, parent = ctypes.c_ulong(), ctypes.c_ulong()
+        children = ctypes.POINTER(ctypes.c_ulong)()
+        count = ctypes.c_uint()
+        if not self._xlib.XQueryTree(self._display, window, ctypes.byref(root), ctypes.byref(parent),
+                                     ctypes.byref(children), ctypes.byref(count)):
+            return None
+        try:
+            for i in range(count.value):
+                found = self._find_window(children[i], window_name)
+                if found is not None:
+                    return found
+        finally:
+            if children:
+                self._xlib.XFree(children)
+        return None
+
+    def _shm_image(self, width, height):
+        key = (width, height)
+        if key in self._images:
+            return self._images[key]
+
+        shminfo = _XShmSegmentInfo()
+        ximage = self._xext.XShmCreateImage(
+            self._display, self._attrs.visual, self._attrs.depth, self._ZPIXMAP,
+            None, ctypes.byref(shminfo), width, height)
+        if not ximage:
+            raise RuntimeError("XShmCreateImage failed")
+        nbytes = ximage.contents.bytes_per_line * height
+        shminfo.shmid = self._libc.shmget(self._IPC_PRIVATE, nbytes, self._IPC_CREAT | 0o600)
+        if shminfo.shmid < 0:
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        shminfo.shmaddr = self._libc.shmat(shminfo.shmid, None, 0)
+        ximage.contents.data = shminfo.shmaddr
+        shminfo.readOnly = 0
+        self._xext.XShmAttach(self._display, ctypes.byref(shminfo))
+        self._xlib.XSync(self._display, 0)
+        # Mark the segment for removal now, it is freed once both sides detach
+        self._libc.shmctl(shminfo.shmid, self._IPC_RMID, None)
+
+        buffer = (ctypes.c_ubyte * nbytes).from_address(shminfo.shmaddr)
+        pixels = np.ctypeslib.as_array(buffer).reshape(height, ximage.contents.bytes_per_line // 4, 4)
+        self._images[key] = (ximage, shminfo, pixels[:, :width])
+        return self._images[key]
+
+    def size(self):
+        return (self._attrs.width, self._attrs.height)
+
+    def _grab_shm(self, bbox):
+        if bbox is None:
+            bbox = (0, 0, self._attrs.width, self._attrs.height)
+        left, top, right, bottom = bbox
+        ximage, shminfo, pixels = self._shm_image(right - left, bottom - top)
+        if not self._xext.XShmGetImage(self._display, self._window, ximage, left, top, self._ALL_PLANES):
+            raise RuntimeError("XShmGetImage failed")
+        return pixels
+
+    def grab(self, bbox=None):
+        # The segment is overwritten by the next grab, so hand out a copy
+        return self._grab_shm(bbox).copy()
+
+    def grab_into(self, dst, bbox=None):
+        np.copyto(dst, self._grab_shm(bbox))
+        return dst
+
+    def close(self):
+        for ximage, shminfo, pixels in self._images.values():
+            self._xext.XShmDetach(self._display, ctypes.byref(shminfo))
+            self._libc.shmdt(shminfo.shmaddr)
+        self._images = {}
+        if self._display:
+            self._xlib.XCloseDisplay(self._display)
+            self._display = None
+
+
+class ReplayCapture(CaptureBackend):
+    """Replays frames from a video file or a directory of screenshots"""
+    name = "replay"
+    color_order = "BGR"
+
+    def __init__(self, path, loop=True):
+        self.path = path
+        self.loop = loop
+        self._video = None
+        self._files = None
+        self._index = 0
+        if os.path.isdir(path):
+            self._files = sorted(
+                os.path.join(path, f) for f in os.listdir(path)
+                if f.lower().endswith(IMAGE_EXTENSIONS))
+            if not self._files:
+                raise RuntimeError(f"No images found in {path}")
+        else:
+            self._video = cv.VideoCapture(path)
+            if not self._video.isOpened():
+                raise RuntimeError(f"Cannot open video {path}")
+        self._current = self._next_frame()
+        self._fresh = True
+        self._size = (self._current.shape[1], self._current.shape[0])
+
+    def _next_frame(self, dst=None):
+        if self._files is not None:
+            if self._index >= len(self._files):
+                if not self.loop:
+                    raise EOFError(f"End of replay {self.path}")
+                self._index = 0
+            frame = cv.imread(self._files[self._index])
+            self._index += 1
+            return frame
+
+        # VideoCapture decodes straight into the previous frame's buffer
+        ok, frame = self._video.read(dst)
+        if not ok:
+            if not self.loop:
+                raise EOFError(f"End of replay {self.path}")
+            self._video.set(cv.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._video.read(dst)
+        return frame
+
+    def size(self):
+        return self._size
+
+    def begin_frame(self):
+        if self._fresh:
+            self._fresh = False
+        else:
+            self._current = self._next_frame(self._current)
+
+    def grab(self, bbox=None):
+        frame = self._current
+        if bbox is not None:
+            left, top, right, bottom = bbox
+            frame = frame[top:bottom, left:right]
+        return frame
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+
+
+BACKENDS = {
+    PILCapture.name: PILCapture,
+    X11ShmCapture.name: X11ShmCapture,
+    ReplayCapture.name: ReplayCapture,
+}
+
+
+def create_backend(name, **kwargs):
+    """Create a capture backend by name ("pil", "x11shm" or "replay")"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown capture backend: {name}")
+    return BACKENDS[name](**kwargs)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def benchmark(backend, frames=100, warmup=5, bbox=None):
+    """Time repeated grabs from a backend, including the conversion to BGR"""
+    for _ in range(warmup):
+        backend.begin_frame()
+        to_bgr(backend.grab(bbox), backend.color_order)
+
+    latencies = []
+    bytes_copied = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        t0 = time.perf_counter()
+        backend.begin_frame()
+        image = backend.grab(bbox)
+        bytes_copied += image.nbytes
+        to_bgr(image, backend.color_order)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+
+    return {
+        "backend": backend.name,
+        "frames": frames,
+        "fps": frames / total,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "bytes_per_frame": bytes_copied / frames,
+    }
+
+
+def bench_capture(frames=100, window_name=None, replay_path=None):
+    """Benchmark every capture backend available on this machine"""
+    candidates = [
+        ("pil", {}),
+        ("x11shm", {"window_name": window_name}),
+    ]
+    if replay_path is not None:
+        candidates.append(("replay", {"path": replay_path}))
+
+    print(f"Benchmarking capture backends over {frames} frames...")
+    print(f"{'backend':<10}{'fps':>10}{'p50 ms':>10}{'p99 ms':>10}{'MB/frame':>10}")
+    results = []
+    for name, kwargs in candidates:
+        try:
+            backend = create_backend(name, **kwargs)
+        except Exception as e:
+            print(f"{name:<10}unavailable: {e}")
+            continue
+        try:
+            result = benchmark(backend, frames)
+        except Exception as e:
+            print(f"{name:<10}failed: {e}")
+            continue
+        finally:
+            backend.close()
+        results.append(result)
+        print(f"{name:<10}{result['fps']:>10.1f}{result['p50_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['bytes_per_frame'] / 1e6:>10.2f}")
+    return results
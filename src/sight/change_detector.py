@@ -0,0 +1,71 @@
+import numpy as np
+import cv2 as cv
+
+
+# Side of a change detection tile in screen pixels
+TILE_SIZE = 32
+# Samples per tile side in the downsampled frame
+SAMPLES_PER_TILE = 4
+# Mean absolute difference (0-255) above which a tile counts as changed
+CHANGE_THRESHOLD = 3.0
+
+
+def tile_range(region, tile_size=TILE_SIZE):
+    """Tile index slices covering a (left, top, right, bottom) screen region"""
+    left, top, right, bottom = region
+    return (slice(max(top, 0) // tile_size, -(-bottom // tile_size)),
+            slice(max(left, 0) // tile_size, -(-right // tile_size)))
+
+
+class ChangeDetector:
+    """Cheap per-tile change detection between consecutive frames.
+
+    Each frame is point-sampled down to a few samples per tile and compared
+    with the previous thumbnail. For every tile the detector remembers the
+    id of the last frame in which it changed, so a consumer that skipped
+    frames can still ask whether anything changed since the frame it last
+    processed.
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, threshold=CHANGE_THRESHOLD):
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self._shape = None
+        self._thumb = None
+        self._prev_thumb = None
+        self._diff = None
+        self.last_changed = None
+
+    def _reset(self, shape):
+        height, width = shape[:2]
+        self.tiles_y = -(-height // self.tile_size)
+        self.tiles_x = -(-width // self.tile_size)
+        thumb_shape = (self.tiles_y * SAMPLES_PER_TILE, self.tiles_x * SAMPLES_PER_TILE, shape[2])
+        self._thumb = np.zeros(thumb_shape, dtype=np.uint8)
+        self._prev_thumb = np.zeros(thumb_shape, dtype=np.uint8)
+        self._diff = np.zeros(thumb_shape, dtype=np.uint8)
+        self.last_changed = np.zeros((self.tiles_y, self.tiles_x), dtype=np.int64)
+        self._shape = shape
+
+    def update(self, image, frame_id):
+        """Compare image with the previous one and return the per-tile dirty flags"""
+        if self._shape != image.shape:
+            self._reset(image.shape)
+            self.last_changed[:] = frame_id
+            dirty = np.ones((self.tiles_y, self.tiles_x), dtype=bool)
+        else:
+            self._thumb, self._prev_thumb = self._prev_thumb, self._thumb
+            dirty = None
+
+        # Nearest neighbour only reads the sampled pixels, far cheaper than
+        # averaging the whole frame
+        cv.resize(image, (self._thumb.shape[1], self._thumb.shape[0]),
+                  dst=self._thumb, interpolation=cv.INTER_NEAREST)
+        if dirty is not None:
+            return dirty
+
+        cv.absdiff(self._thumb, self._prev_thumb, dst=self._diff)
+        tiles = self._diff.reshape(self.tiles_y, SAMPLES_PER_TILE, self.tiles_x, -1)
+        dirty = tiles.mean(axis=(1, 3)) > self.threshold
+        self.last_changed[dirty] = frame_id
+        return dirty
@@ -0,0 +1,75 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import cv2 as cv
+
+
+# Vision worker threads. OpenCV and large numpy operations release the GIL,
+# so threads run template searches on all cores without copying frames
+VISION_WORKERS = os.cpu_count() or 1
+# Rows handed to one worker when a single search is split into bands
+MIN_BAND_ROWS = 64
+
+
+class VisionExecutor:
+    """Shared thread pool for template and region searches.
+
+    Jobs are (function, *args) tuples; run() starts them all and gathers the
+    results in order, giving up on the ones that are not done by the
+    deadline. With a single worker, jobs run inline on the calling thread.
+    Jobs must not submit jobs of their own, the pool could deadlock.
+    """
+
+    def __init__(self, workers=VISION_WORKERS):
+        self.workers = max(1, workers)
+        self._pool = None
+        if self.workers > 1:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="vision")
+        self.late_jobs = 0
+
+    def run(self, jobs, timeout=None):
+        """Results of jobs in order, None for every job not finished within timeout seconds"""
+        if self._pool is None:
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            results = []
+            for function, *args in jobs:
+                if deadline is not None and time.perf_counter() > deadline:
+                    results.append(None)
+                    self.late_jobs += 1
+                    continue
+                results.append(function(*args))
+            return results
+
+        futures = [self._pool.submit(function, *args) for function, *args in jobs]
+        done, pending = wait(futures, timeout)
+        for future in pending:
+            future.cancel()
+        self.late_jobs += len(pending)
+        return [future.result() if future in done else None for future in futures]
+
+    def match_template(self, image, template, timeout=None, mask=None):
+        """cv.matchTemplate(TM_CCOEFF_NORMED) split into row bands, one per worker.
+
+        mask is the template's 0/255 mask, or None to match all of it.
+        Rows of bands that missed the deadline score -1, so they never win.
+        """
+        t_height = template.shape[0]
+        rows = image.shape[0] - t_height + 1
+        bands = min(self.workers, max(1, rows // MIN_BAND_ROWS))
+        if bands <= 1:
+            return cv.matchTemplate(image, template, cv.TM_CCOEFF_NORMED, mask=mask)
+
+        edges = np.linspace(0, rows, bands + 1).astype(int)
+        jobs = [(cv.matchTemplate, image[top:bottom + t_height - 1], template, cv.TM_CCOEFF_NORMED, None, mask)
+                for top, bottom in zip(edges, edges[1:])]
+        result = np.full((rows, image.shape[1] - template.shape[1] + 1), -1.0, dtype=np.float32)
+        for top, band in zip(edges, self.run(jobs, timeout)):
+            if band is not None:
+                result[top:top + band.shape[0]] = band
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
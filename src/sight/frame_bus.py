@@ -0,0 +1,194 @@
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from sight.frame_store import Frame
+
+
+# Default shared memory block name, readers attach to it by name
+BUS_NAME = "wowzer_frames"
+# Frames kept in the ring; a reader has this many frame periods to use a frame
+BUS_SLOTS = 4
+# How often waiting readers look for a new frame (seconds)
+BUS_POLL = 0.001
+
+# Block layout: BUS_HEADER, then BUS_SLOTS slots of SLOT_HEADER + pixels.
+# BUS_HEADER: magic, slot count, pixel bytes per slot, latest frame id.
+# SLOT_HEADER: sequence (odd while the slot is written), frame id,
+# timestamp, height, width, channels, colour order.
+BUS_MAGIC = b'WZBUS001'
+BUS_HEADER = struct.Struct('<8sIIQ')
+SLOT_HEADER = struct.Struct('<QQdIIB4s')
+# Headers are padded so pixel data stays 64-byte aligned
+HEADER_SIZE = 64
+LATEST_OFFSET = 16
+
+
+def _slot_offset(index, slot_size):
+    return HEADER_SIZE + index * (HEADER_SIZE + slot_size)
+
+
+class FrameBus:
+    """Publishes captured frames into a shared memory ring for other processes.
+
+    The block is created on the first publish(), sized for that frame. Each
+    slot is guarded by a sequence number that is odd while the capture
+    thread writes it, so readers (FrameBusReader) can tell a torn or
+    recycled frame from a good one without any lock between processes.
+    """
+
+    def __init__(self, name=BUS_NAME, slots=BUS_SLOTS):
+        self.name = name
+        self.slots = slots
+        self.slot_size = 0
+        self._memory = None
+
+    def _create(self, slot_size):
+        try:
+            # Left behind by a capture process that did not shut down cleanly
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.slot_size = slot_size
+        self._memory = shared_memory.SharedMemory(
+            self.name, create=True, size=_slot_offset(self.slots, slot_size))
+        BUS_HEADER.pack_into(self._memory.buf, 0, BUS_MAGIC, self.slots, slot_size, 0)
+        print(f"Frame bus {self.name}: {self.slots} slots of {slot_size / 1e6:.1f} MB")
+
+    def publish(self, frame):
+        """Copy a published sight.frame_store.Frame into the next slot"""
+        image = frame.image
+        if self._memory is None:
+            self._create(image.nbytes)
+        if image.nbytes > self.slot_size:
+            raise ValueError(f"Frame of {image.nbytes} bytes does not fit the bus slots of {self.slot_size}")
+
+        buf = self._memory.buf
+        offset = _slot_offset(frame.frame_id % self.slots, self.slot_size)
+        sequence = struct.unpack_from('<Q', buf, offset)[0]
+        struct.pack_into('<Q', buf, offset, sequence + 1)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        pixels = np.ndarray(image.shape, dtype=np.uint8, buffer=buf, offset=offset + HEADER_SIZE)
+        np.copyto(pixels, image)
+        SLOT_HEADER.pack_into(buf, offset, sequence + 2, frame.frame_id, frame.timestamp,
+                              height, width, channels, frame.color_order.encode().ljust(4))
+        struct.pack_into('<Q', buf, LATEST_OFFSET, frame.frame_id)
+
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+
+def _attach(name):
+    """Open an existing block without letting this process's resource tracker unlink it on exit"""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument
+        from multiprocessing import resource_tracker
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+class BusFrame(Frame):
+    """Frame read from the bus; image is a zero-copy view into shared memory"""
+
+    def __init__(self, frame_id, timestamp, image, color_order, reader, offset, sequence):
+        super().__init__(frame_id, timestamp, image, color_order)
+        self._reader = reader
+        self._offset = offset
+        self._sequence = sequence
+
+    def valid(self):
+        """False once the capture process has started overwriting this frame's slot"""
+        return self._reader.sequence(self._offset) == self._sequence
+
+
+class FrameBusReader:
+    """Attaches to a FrameBus from another process and reads its frames without copying"""
+
+    def __init__(self, name=BUS_NAME):
+        self.name = name
+        self._memory = _attach(name)
+        magic, self.slots, self.slot_size, latest = BUS_HEADER.unpack_from(self._memory.buf, 0)
+        if magic != BUS_MAGIC:
+            raise ValueError(f"Shared memory {name} is not a wowzer frame bus")
+
+    @property
+    def last_id(self):
+        return struct.unpack_from('<Q', self._memory.buf, LATEST_OFFSET)[0]
+
+    def sequence(self, offset):
+        return struct.unpack_from('<Q', self._memory.buf, offset)[0]
+
+    def latest(self):
+        """Most recently published frame, or None before the first one"""
+        while True:
+            frame_id = self.last_id
+            if frame_id == 0:
+                return None
+            offset = _slot_offset(frame_id % self.slots, self.slot_size)
+            sequence, slot_id, timestamp, height, width, channels, color_order = \
+                SLOT_HEADER.unpack_from(self._memory.buf, offset)
+            if sequence % 2 or slot_id != frame_id:
+                # Overtaken by the writer between reading the id and the slot
+                continue
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            image = np.ndarray(shape, dtype=np.uint8, buffer=self._memory.buf, offset=offset + HEADER_SIZE)
+            image.flags.writeable = False
+            frame = BusFrame(frame_id, timestamp, image, color_order.decode().strip(), self, offset, sequence)
+            if frame.valid():
+                return frame
+
+    def wait_for_frame(self, after_id=None, timeout=None):
+        """Block until a frame newer than after_id is published, None on timeout"""
+        if after_id is None:
+            after_id = self.last_id
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.last_id <= after_id:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            time.sleep(BUS_POLL)
+        return self.latest()
+
+    def close(self):
+        try:
+            self._memory.close()
+        except BufferError:
+            # Frames handed out are still referenced, the mapping goes away with them
+            pass
+
+
+def monitor_bus(name=BUS_NAME, seconds=10):
+    """Attach to a running capture's frame bus and print the frame rate and latency seen"""
+    reader = FrameBusReader(name)
+    print(f"Attached to frame bus {name} ({reader.slots} slots)")
+    start = time.time()
+    frames = 0
+    latencies = []
+    torn = 0
+    last_id = reader.last_id
+    while time.time() - start < seconds:
+        frame = reader.wait_for_frame(last_id, timeout=1)
+        if frame is None:
+            continue
+        latencies.append(time.time() - frame.timestamp)
+        # Touch the pixels, then make sure they were not recycled meanwhile
+        frame.image.mean()
+        if not frame.valid():
+            torn += 1
+        frames += 1
+        last_id = frame.frame_id
+    reader.close()
+    elapsed = time.time() - start
+    mean_latency = sum(latencies) / len(latencies) * 1000 if latencies else 0.0
+    print(f"Read {frames} frames in {elapsed:.1f}s ({frames / elapsed:.1f} FPS), "
+          f"mean latency {mean_latency:.1f} ms, {torn} recycled while reading")
@@ -0,0 +1,364 @@
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock, RLock
+
+import numpy as np
+import cv2 as cv
+
+from sight.capture import TO_BGR
+from sight.change_detector import tile_range
+
+
+# cv.cvtColor codes from BGR to the colour spaces consumers can ask for
+FROM_BGR = {
+    "hsv": cv.COLOR_BGR2HSV,
+    "gray": cv.COLOR_BGR2GRAY,
+}
+
+
+class Frame:
+    """One captured frame with its frame id and capture time.
+
+    The frame keeps the image exactly as the capture backend delivered it
+    (color_order). BGR, HSV and grayscale versions are only computed when a
+    consumer asks for them, only for the region asked for, and are cached on
+    the frame so several consumers share one conversion. Conversions are
+    written into the scratch memory of the frame's store slot, which is
+    reused when the slot comes round again instead of being reallocated.
+
+    A frame is never modified after it is published, but its buffers are
+    recycled two frames later. Readers that need it for longer, e.g. for a
+    full-screen template scan, keep it with FrameStore.hold().
+    """
+
+    def __init__(self, frame_id, timestamp, image, color_order="BGR", slot=None):
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.image = image
+        self.color_order = color_order
+        self._slot = slot
+        self._cache = {}
+        # Agents and the capture thread may convert the same frame at once
+        self._convert_lock = RLock()
+
+        # Filled in by the store's change detector, see changed_since()
+        self.dirty = None
+        self.last_changed = None
+        self.tile_size = None
+
+    @property
+    def shape(self):
+        return self.image.shape[:2] + (3,)
+
+    @property
+    def bgr(self):
+        """Full frame in BGR"""
+        return self.convert("bgr")
+
+    @property
+    def hsv(self):
+        """Full frame in HSV"""
+        return self.convert("hsv")
+
+    def gray(self, region=None):
+        return self.convert("gray", region)
+
+    def convert(self, space, region=None):
+        """Return the frame (or a (left, top, right, bottom) region of it) in "bgr", "hsv" or "gray".
+
+        Results are memoised per frame; a region of a colour space that was
+        already converted in full is sliced instead of converted again.
+        Safe to call from several threads, one conversion of a frame runs at a time.
+        """
+        if region is not None:
+            region = self._clip(region)
+        key = (space, region)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        with self._convert_lock:
+            return self._convert(space, region, key)
+
+    def _convert(self, space, region, key):
+        cached = self._cache.get(key)
+        if cached is not None:
+            # Converted by another thread while this one waited
+            return cached
+
+        full = self._cache.get((space, None))
+        if region is not None and full is not None:
+            left, top, right, bottom = region
+            result = full[top:bottom, left:right]
+        elif space == "bgr":
+            result = self._raw(region)
+            code = TO_BGR[self.color_order]
+            if code is not None:
+                result = cv.cvtColor(result, code, dst=self._buffer(result.shape[:2] + (3,)))
+        else:
+            src = self.convert("bgr", region)
+            shape = src.shape[:2] if space == "gray" else src.shape
+            result = cv.cvtColor(src, FROM_BGR[space], dst=self._buffer(shape))
+
+        self._cache[key] = result
+        return result
+
+    def _buffer(self, shape):
+        """Output buffer for a conversion from the store slot, None to let OpenCV allocate one"""
+        if self._slot is None or not self.valid():
+            return None
+        return self._slot.buffer(shape)
+
+    def valid(self):
+        """False once the store has started reusing this frame's buffers"""
+        return self._slot is None or self._slot.frame is self
+
+    def changed_since(self, frame_id, region=None):
+        """Whether anything (inside region) changed after frame frame_id.
+
+        Always True when the store has no change detector.
+        """
+        if self.last_changed is None:
+            return True
+        tiles = self.last_changed
+        if region is not None:
+            tiles = tiles[tile_range(region, self.tile_size)]
+        return bool((tiles > frame_id).any())
+
+    @property
+    def changed(self):
+        """Whether any tile changed compared with the previous frame"""
+        return self.dirty is None or bool(self.dirty.any())
+
+    def pixel(self, x, y, space="bgr"):
+        """Single pixel at screen position (x, y)"""
+        return self.convert(space, (x, y, x + 1, y + 1))[0, 0]
+
+    def _raw(self, region):
+        if region is None:
+            return self.image
+        left, top, right, bottom = region
+        return self.image[top:bottom, left:right]
+
+    def _clip(self, region):
+        height, width = self.image.shape[:2]
+        left, top, right, bottom = (int(v) for v in region)
+        return (min(max(left, 0), width), min(max(top, 0), height),
+                min(max(right, 0), width), min(max(bottom, 0), height))
+
+    def age(self):
+        """Seconds since the frame was captured"""
+        return time.time() - self.timestamp
+
+
+class _Slot:
+    """One buffer set of the frame store: the capture image plus scratch memory for conversions.
+
+    Conversion outputs are carved one after the other out of a single
+    scratch array, whatever their region or shape, and the slot starts
+    again from the beginning for its next frame. Moving bobber or target
+    windows therefore never allocate; the scratch array only grows while
+    a frame needs more than it has ever needed before.
+    """
+
+    # Offsets into the scratch array are kept aligned to this many bytes
+    ALIGN = 64
+
+    def __init__(self, store):
+        self.store = store
+        self.frame = None
+        self.image = None
+        self.tag = None
+        self.scratch = np.empty(0, dtype=np.uint8)
+        self.used = 0
+        # Readers holding this slot's frame, see FrameStore.hold()
+        self.holds = 0
+
+    def reset(self):
+        """Hand out the scratch memory from the start again, for a new frame"""
+        self.used = 0
+
+    def buffer(self, shape, dtype=np.uint8):
+        """An uninitialised array of shape and dtype in the scratch memory"""
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        if self.used + size > self.scratch.size:
+            # Arrays already handed out keep the old scratch alive until the frame is dropped
+            self.scratch = np.empty(2 * (self.used + size), dtype=np.uint8)
+            self.used = 0
+            self.store.allocations += 1
+        buffer = self.scratch[self.used:self.used + size].view(dtype).reshape(shape)
+        self.used += -(-size // self.ALIGN) * self.ALIGN
+        return buffer
+
+
+class FrameStore:
+    """Triple buffer of captured frames.
+
+    The capture thread is the only writer. It asks for the back slot's
+    preallocated image with back_buffer(), grabs into it and publishes it
+    with a single reference assignment, which is atomic in Python, so
+    reading latest() takes no lock and never sees half a frame. The writer
+    only comes back to a slot after two newer frames, which leaves readers
+    two frame periods to finish with a frame before its buffers are
+    recycled. Readers that need longer hold() the frame: the writer skips
+    held slots and adds a slot when every other one is held, up to
+    MAX_SLOTS, then waits for a release. Holding and picking the back slot
+    share a small lock; conversions lock per frame, see Frame.convert().
+
+    Agents that want every frame block in wait_for_frame() instead of
+    polling latest(); the condition variable is only used for wake-ups.
+
+    With a change_detector every published frame carries per-tile dirty
+    flags, so consumers can skip frames or regions that did not change.
+    """
+
+    # Most slots the store grows to while readers hold frames
+    MAX_SLOTS = 8
+
+    def __init__(self, slots=3, change_detector=None):
+        self._slots = [_Slot(self) for _ in range(slots)]
+        self.change_detector = change_detector
+        self._back = 0
+        self._last_id = 0
+        self._latest = None
+        self._new_frame = Condition()
+        # Guards the hold counts and the writer's choice of slot
+        self._holds_lock = Lock()
+        self._released = Condition(self._holds_lock)
+        # Number of pixel buffers allocated so far, flat once capture is warmed up
+        self.allocations = 0
+
+    def back_buffer(self, shape, tag=None):
+        """Preallocated image buffer of the back slot (capture thread only).
+
+        Returns (buffer, previous_tag): the tag the buffer was last handed
+        out with, so the writer can tell whether stale content must be
+        cleared (e.g. when the ROI layout changed).
+        """
+        slot = self._claim_slot()
+        previous_tag = slot.tag
+        if slot.image is None or slot.image.shape != shape:
+            slot.image = np.zeros(shape, dtype=np.uint8)
+            self.allocations += 1
+            previous_tag = None
+        slot.tag = tag
+        return slot.image, previous_tag
+
+    def _free_slot(self):
+        """Index of the next slot no reader holds and not showing the latest frame, None if there is none"""
+        count = len(self._slots)
+        for step in range(count):
+            index = (self._back + step) % count
+            slot = self._slots[index]
+            if slot.holds == 0 and (slot.frame is None or slot.frame is not self._latest):
+                return index
+        return None
+
+    def _claim_slot(self):
+        """The next free slot, made the back slot.
+
+        When every other slot is held a new one is added, up to MAX_SLOTS;
+        past that the writer waits until a reader lets go of a frame.
+        """
+        with self._holds_lock:
+            index = self._free_slot()
+            if index is None and len(self._slots) < self.MAX_SLOTS:
+                index = len(self._slots)
+                self._slots.append(_Slot(self))
+            if index is None:
+                print(f"WARNING: All {self.MAX_SLOTS} frame slots are held, capture waits for a release")
+                while index is None:
+                    self._released.wait()
+                    index = self._free_slot()
+            slot = self._slots[index]
+            # The frame living in this slot is about to be overwritten
+            slot.frame = None
+            slot.reset()
+            self._back = index
+            return slot
+
+    @contextmanager
+    def hold(self, frame=None):
+        """Keep frame (by default the latest) from being recycled until the with block ends.
+
+        Yields the frame, or None if there is none or its buffers were
+        already reused.
+        """
+        slot = None
+        with self._holds_lock:
+            if frame is None:
+                frame = self._latest
+            if frame is not None and not frame.valid():
+                frame = None
+            if frame is not None and frame._slot is not None:
+                slot = frame._slot
+                slot.holds += 1
+        try:
+            yield frame
+        finally:
+            if slot is not None:
+                with self._holds_lock:
+                    slot.holds -= 1
+                    self._released.notify_all()
+
+    def publish(self, image, color_order="BGR", timestamp=None):
+        """Publish a new frame (capture thread only) and return it.
+
+        image is normally the array returned by back_buffer(); any other
+        array is published as is.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        slot = self._slots[self._back]
+        if image is not slot.image:
+            slot = self._claim_slot()
+        frame = Frame(self._last_id + 1, timestamp, image, color_order, slot)
+        if self.change_detector is not None:
+            frame.dirty = self.change_detector.update(image, frame.frame_id)
+            last_changed = self.change_detector.last_changed
+            frame.last_changed = slot.buffer(last_changed.shape, last_changed.dtype)
+            np.copyto(frame.last_changed, last_changed)
+            frame.tile_size = self.change_detector.tile_size
+        slot.frame = frame
+        self._back = (self._back + 1) % len(self._slots)
+        self._latest = frame
+        self._last_id = frame.frame_id
+        with self._new_frame:
+            self._new_frame.notify_all()
+        return frame
+
+    def latest(self):
+        """Most recently published frame, or None before the first capture"""
+        return self._latest
+
+    def newer_than(self, frame_id):
+        """Latest frame if it is newer than frame_id, otherwise None"""
+        frame = self._latest
+        if frame is not None and frame.frame_id > frame_id:
+            return frame
+        return None
+
+    def wait_for_frame(self, after_id=None, timeout=None):
+        """Block until a frame newer than after_id is published.
+
+        after_id defaults to the latest frame, i.e. wait for the next one.
+        Returns the frame, or None if timeout (seconds) expires first.
+        """
+        if after_id is None:
+            after_id = self._last_id
+        with self._new_frame:
+            if self._new_frame.wait_for(lambda: self._last_id > after_id, timeout):
+                return self._latest
+        return None
+
+    def get(self, frame_id):
+        """Frame with the given id if its buffers have not been recycled yet"""
+        for slot in self._slots:
+            frame = slot.frame
+            if frame is not None and frame.frame_id == frame_id:
+                return frame
+        return None
+
+    @property
+    def last_id(self):
+        return self._last_id
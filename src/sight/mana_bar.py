@@ -1,13 +1,19 @@
-
 import time
 
 
+# Mana fraction below which watch_mana warns
+MANA_WARNING = 0.75
+
+
 def watch_mana(agent):
+    """Print a warning each time mana drops below MANA_WARNING, read from agent.ui_state"""
+    warned = False
     while True:
-        if agent.cur_img:
-            # Mana 75% Detection
-            r, g, b = agent.cur_img.getpixel((255, 76))
-            if r > 10 or g > 10 or b < 190 or b > 220:
-                print("Mana at 75%!")
+        state = agent.ui_state
+        if state is not None and state.mana is not None:
+            low = state.mana < MANA_WARNING
+            if low and not warned:
+                print(f"Mana at {state.mana:.0%}!")
+            warned = low
 
         time.sleep(1)
@@ -0,0 +1,510 @@
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+import cv2 as cv
+
+
+# Pyramid levels searched above full resolution, each one halves the image
+PYRAMID_LEVELS = 3
+# Smallest template side (in pixels) still matched at a coarse level
+MIN_TEMPLATE_SIDE = 4
+# Coarse peaks refined at full resolution
+TOP_CANDIDATES = 4
+# Extra pixels searched around each upscaled candidate when refining
+REFINE_MARGIN = 3
+# How far below the wanted score a coarse peak may be and still get refined
+COARSE_SLACK = 0.15
+
+# Coarse peaks per template considered when collecting every detection
+DETECT_CANDIDATES = 16
+# Detections overlapping a better one by more than this (intersection over union) are dropped
+NMS_OVERLAP = 0.3
+
+# location is the top-left corner in image coordinates, size the (width,
+# height) of the template at the scale it matched
+Match = namedtuple("Match", ["location", "score", "scale", "size"])
+# One object found by TemplateBatch.detect_all(); bbox is (left, top, right, bottom)
+Detection = namedtuple("Detection", ["name", "bbox", "score"])
+
+
+def build_pyramid(image, levels):
+    """[image, image / 2, image / 4, ...] with levels + 1 entries"""
+    pyramid = [image]
+    for _ in range(levels):
+        if min(pyramid[-1].shape[:2]) < 2:
+            break
+        pyramid.append(cv.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def template_pyramid(template, scale, levels):
+    """Template resized by scale, then downsampled as far as MIN_TEMPLATE_SIDE allows"""
+    scaled = template
+    if scale != 1.0:
+        scaled = cv.resize(template, None, fx=scale, fy=scale,
+                           interpolation=cv.INTER_AREA if scale < 1 else cv.INTER_LINEAR)
+    min_side = min(scaled.shape[:2])
+    usable = 0
+    if min_side >= MIN_TEMPLATE_SIDE:
+        usable = min(levels, int(math.log2(min_side / MIN_TEMPLATE_SIDE)))
+    return build_pyramid(scaled, usable)
+
+
+def fitting_level(template_levels, pyramid):
+    """Coarsest level at which the template still fits inside the image"""
+    level = min(len(template_levels), len(pyramid)) - 1
+    while level > 0 and (template_levels[level].shape[0] > pyramid[level].shape[0] or
+                         template_levels[level].shape[1] > pyramid[level].shape[1]):
+        level -= 1
+    return level
+
+
+def remaining(deadline):
+    """Seconds left until a time.perf_counter() deadline (None for no deadline)"""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.perf_counter())
+
+
+def run_jobs(jobs, executor=None, deadline=None):
+    """Run (function, *args) jobs on a sight.executor.VisionExecutor, or inline without one"""
+    if executor is None:
+        return [function(*args) for function, *args in jobs]
+    return executor.run(jobs, remaining(deadline))
+
+
+def template_mask(template, scale):
+    """0/255 mask of a sight.templates.Template at scale, None to match all of the template"""
+    if hasattr(template, "scaled_mask"):
+        return template.scaled_mask(scale)
+    return None
+
+
+def match_template(image, template, template_mask=None):
+    """cv.matchTemplate TM_CCOEFF_NORMED result, optionally masked.
+
+    Masked scores of flat windows come out NaN; they score -1 instead,
+    so they never win.
+    """
+    result = cv.matchTemplate(image, template, cv.TM_CCOEFF_NORMED, mask=template_mask)
+    if template_mask is not None:
+        np.nan_to_num(result, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+    return result
+
+
+def search(image, template, executor=None, deadline=None, template_mask=None):
+    """Full TM_CCOEFF_NORMED result, split across the executor's workers if there is one"""
+    if executor is None:
+        return match_template(image, template, template_mask)
+    result = executor.match_template(image, template, remaining(deadline), template_mask)
+    if template_mask is not None:
+        np.nan_to_num(result, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+    return result
+
+
+def refine_each(image, template, peaks, factor, scale, offset=(0, 0), executor=None, deadline=None, mask=None,
+                template_mask=None):
+    """Full-resolution Match for every coarse peak found at 1 / factor size, refined in a small window.
+
+    With a sight.search_mask.SearchMask, matches it excludes are dropped.
+    With a template_mask only the template pixels it keeps are compared.
+    """
+    t_height, t_width = template.shape[:2]
+    height, width = image.shape[:2]
+    pad = factor + REFINE_MARGIN
+    corners = []
+    jobs = []
+    for (x, y), _ in peaks:
+        x0 = max(x * factor - pad, 0)
+        y0 = max(y * factor - pad, 0)
+        x1 = min(x * factor + pad + t_width, width)
+        y1 = min(y * factor + pad + t_height, height)
+        if y1 - y0 < t_height or x1 - x0 < t_width:
+            continue
+        corners.append((x0, y0))
+        jobs.append((match_template, image[y0:y1, x0:x1], template, template_mask))
+
+    matches = []
+    for (x0, y0), result in zip(corners, run_jobs(jobs, executor, deadline)):
+        if result is None:
+            continue
+        if mask is not None:
+            mask.apply(result, (t_width, t_height), 1, (x0 + offset[0], y0 + offset[1]))
+        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(result)
+        location = (max_loc[0] + x0 + offset[0], max_loc[1] + y0 + offset[1])
+        if mask is not None and not mask.contains(location, (t_width, t_height)):
+            continue
+        matches.append(Match(location, max_val, scale, (t_width, t_height)))
+    return matches
+
+
+def refine_peaks(image, template, peaks, factor, scale, offset=(0, 0), executor=None, deadline=None, mask=None,
+                 template_mask=None):
+    """Best full-resolution Match in small windows around coarse peaks found at 1 / factor size"""
+    matches = refine_each(image, template, peaks, factor, scale, offset, executor, deadline, mask, template_mask)
+    return max(matches, key=lambda match: match.score, default=None)
+
+
+def masked_region(mask, region, image):
+    """Search region cut down to what mask allows (None still means the whole image)"""
+    if mask is None:
+        return region
+    height, width = image.shape[:2]
+    cropped = mask.crop(region)
+    if region is None and cropped == (0, 0, width, height):
+        return None
+    return cropped
+
+
+def non_max_suppression(boxes, scores, overlap=NMS_OVERLAP):
+    """Indices of the boxes to keep, best score first, dropping boxes that overlap a kept one.
+
+    boxes is an (n, 4) array of (left, top, right, bottom).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    order = np.argsort(scores)[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(int(best))
+        # Intersection over union of the kept box with all remaining ones at once
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        intersection = width * height
+        union = areas[best] + areas[rest] - intersection
+        order = rest[intersection <= overlap * union]
+    return keep
+
+
+def top_peaks(result, count, size):
+    """Locations of the count best scores in a matchTemplate result, at least size apart"""
+    result = result.copy()
+    width, height = size
+    peaks = []
+    for _ in range(count):
+        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(result)
+        if not np.isfinite(max_val):
+            break
+        peaks.append((max_loc, max_val))
+        x, y = max_loc
+        result[max(y - height // 2, 0):y + height // 2 + 1,
+               max(x - width // 2, 0):x + width // 2 + 1] = -np.inf
+    return peaks
+
+
+class TemplateMatcher:
+    """Coarse-to-fine TM_CCOEFF_NORMED template search.
+
+    The image is searched on a downsampled pyramid level first, then only
+    the top candidates are refined at full resolution in a small window.
+    Each template is also tried at every factor in scales, to cope with
+    different UI scales and camera zoom. Scaled and downsampled templates
+    are cached, so matching the same template again costs nothing extra.
+    The full-resolution scores of a template with a mask (transparent
+    pixels) only compare the pixels it keeps; on the coarse level those
+    pixels hold the template's mean colour, see sight.templates.Template.
+    """
+
+    def __init__(self, scales=(1.0,), levels=PYRAMID_LEVELS, candidates=TOP_CANDIDATES):
+        self.scales = tuple(scales)
+        self.levels = levels
+        self.candidates = candidates
+        self._templates = {}
+
+    def _template_pyramid(self, template, scale):
+        if hasattr(template, "pyramid"):
+            # A sight.templates.Template keeps its own prepared pyramids
+            return template.pyramid(scale, self.levels)
+        key = (id(template), scale)
+        cached = self._templates.get(key)
+        if cached is None:
+            # Keep a reference to template so its id cannot be reused while cached
+            cached = (template, template_pyramid(template, scale, self.levels))
+            self._templates[key] = cached
+        return cached[1]
+
+    def match(self, image, template, region=None, pyramid=None, executor=None, timeout=None, mask=None):
+        """Best match of template in image (or in a (left, top, right, bottom) region of it).
+
+        template is an image or a sight.templates.Template. pyramid may be a
+        build_pyramid() of image shared between several calls. With a
+        sight.executor.VisionExecutor the searches are split over its
+        workers, and parts not done within timeout seconds are skipped.
+        Matches a sight.search_mask.SearchMask excludes are never returned.
+        Returns a Match, or None if the template does not fit.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        region = masked_region(mask, region, image)
+        best = None
+        for scale in self.scales:
+            found = self._match_scale(image, template, scale, region, pyramid, executor, deadline, mask)
+            if found is not None and (best is None or found.score > best.score):
+                best = found
+        return best
+
+    def _match_scale(self, image, template, scale, region, pyramid, executor, deadline, mask):
+        offset_x, offset_y = 0, 0
+        if region is not None:
+            left, top, right, bottom = region
+            image = image[top:bottom, left:right]
+            offset_x, offset_y = left, top
+            pyramid = None
+
+        template_levels = self._template_pyramid(template, scale)
+        full_template = template_levels[0]
+        full_mask = template_mask(template, scale)
+        t_height, t_width = full_template.shape[:2]
+        height, width = image.shape[:2]
+        if t_height > height or t_width > width:
+            return None
+
+        level = len(template_levels) - 1
+        if pyramid is None or len(pyramid) <= level:
+            pyramid = build_pyramid(image, level)
+        level = fitting_level(template_levels, pyramid)
+
+        if level == 0:
+            result = search(image, full_template, executor, deadline, full_mask)
+            if mask is not None:
+                mask.apply(result, (t_width, t_height), 1, (offset_x, offset_y))
+            min_val, max_val, min_loc, max_loc = cv.minMaxLoc(result)
+            return Match((max_loc[0] + offset_x, max_loc[1] + offset_y), max_val, scale, (t_width, t_height))
+
+        coarse_template = template_levels[level]
+        coarse = search(pyramid[level], coarse_template, executor, deadline)
+        # Flat areas give NaN scores, they must not win the peak search
+        np.nan_to_num(coarse, copy=False, nan=-1.0)
+        if mask is not None:
+            mask.apply(coarse, (t_width, t_height), 2 ** level, (offset_x, offset_y))
+        peaks = top_peaks(coarse, self.candidates, (coarse_template.shape[1], coarse_template.shape[0]))
+        return refine_peaks(image, full_template, peaks, 2 ** level, scale, (offset_x, offset_y),
+                            executor, deadline, mask, full_mask)
+
+
+def window_energy(image, size):
+    """Per-position sum over channels of the pixel variance * n in every size window of image"""
+    width, height = size
+    n = width * height
+    total = None
+    for channel in cv.split(image):
+        sums, squares = cv.integral2(channel, sdepth=cv.CV_64F, sqdepth=cv.CV_64F)
+        s1 = sums[height:, width:] - sums[:-height, width:] - sums[height:, :-width] + sums[:-height, :-width]
+        s2 = squares[height:, width:] - squares[:-height, width:] - squares[height:, :-width] + squares[:-height, :-width]
+        energy = s2 - s1 * s1 / n
+        total = energy if total is None else total + energy
+    return total
+
+
+def dft_channel(channel, dft_shape):
+    """Forward DFT of one image channel zero-padded to dft_shape"""
+    padded = np.zeros(dft_shape, dtype=np.float32)
+    padded[:channel.shape[0], :channel.shape[1]] = channel
+    return cv.dft(padded)
+
+
+def window_norm(image, size):
+    """Per-position norm of the mean-free size windows of image (the NCC denominator)"""
+    return np.sqrt(np.maximum(window_energy(image, size), 0))
+
+
+class TemplateBatch:
+    """Matches a whole set of named templates against an image in one pass.
+
+    Everything that depends only on the image is computed once and shared:
+    the pyramid, the Fourier transform of every pyramid level that some
+    template is matched on, and the window statistics for every template
+    size. Each extra template then costs one spectrum multiply and one
+    inverse DFT at its coarse level plus the refinement around its peaks,
+    instead of a complete matchTemplate of its own. The scores equal
+    TM_CCOEFF_NORMED, so thresholds carry over from the single matcher.
+    Templates with a mask are masked at full resolution, like there.
+
+    templates maps names to images or sight.templates.Template objects.
+    """
+
+    def __init__(self, templates, scales=(1.0,), levels=PYRAMID_LEVELS, candidates=TOP_CANDIDATES):
+        self.candidates = candidates
+        self.levels = levels
+        # (name, scale, template pyramid) for every template at every scale
+        self.entries = []
+        # Full-resolution template mask of every entry, None for most
+        self.masks = []
+        for name, template in templates.items():
+            if template is None:
+                continue
+            for scale in scales:
+                if hasattr(template, "pyramid"):
+                    levels_of_template = template.pyramid(scale, levels)
+                else:
+                    levels_of_template = template_pyramid(template, scale, levels)
+                self.entries.append((name, scale, levels_of_template))
+                self.masks.append(template_mask(template, scale))
+        # Template spectra, keyed by entry index, level and DFT size
+        self._spectra = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _template_spectrum(self, index, level, dft_shape):
+        key = (index, level, dft_shape)
+        spectra = self._spectra.get(key)
+        if spectra is None:
+            template = self.entries[index][2][level].astype(np.float32)
+            template -= template.mean(axis=(0, 1))
+            spectra = [dft_channel(channel, dft_shape) for channel in cv.split(template)]
+            norm = float(np.sqrt((template.astype(np.float64) ** 2).sum()))
+            spectra = (spectra, norm)
+            self._spectra[key] = spectra
+        return spectra
+
+    def _scores(self, index, level, level_image, image_spectra, energy):
+        """TM_CCOEFF_NORMED result of entry index on one pyramid level"""
+        name, scale, template_levels = self.entries[index]
+        if level == 0 and self.masks[index] is not None:
+            return match_template(level_image, template_levels[0], self.masks[index])
+        height, width = level_image.shape[:2]
+        t_height, t_width = template_levels[level].shape[:2]
+        spectra, norm = self._template_spectrum(index, level, image_spectra[0].shape)
+
+        product = None
+        for image_spectrum, template_spectrum in zip(image_spectra, spectra):
+            channel = cv.mulSpectrums(image_spectrum, template_spectrum, 0, conjB=True)
+            product = channel if product is None else product + channel
+        correlation = cv.idft(product, flags=cv.DFT_SCALE | cv.DFT_REAL_OUTPUT)
+        correlation = correlation[:height - t_height + 1, :width - t_width + 1]
+
+        denominator = energy * norm
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (correlation / denominator).astype(np.float32)
+        # Flat windows or templates have no defined score
+        scores[denominator < 1e-6] = -1.0
+        return scores
+
+    def _match_entry(self, index, level, image, offset, level_image, image_spectra, energy, min_score, mask):
+        """Match of entry index searched on one pyramid level, refined on the full image"""
+        name, scale, template_levels = self.entries[index]
+        scores = self._scores(index, level, level_image, image_spectra, energy)
+        size = template_levels[level].shape[1::-1]
+        if mask is not None:
+            mask.apply(scores, template_levels[0].shape[1::-1], 2 ** level, offset)
+        if level == 0:
+            min_val, max_val, min_loc, max_loc = cv.minMaxLoc(scores)
+            return Match((max_loc[0] + offset[0], max_loc[1] + offset[1]), max_val, scale, size)
+
+        peaks = top_peaks(scores, self.candidates, size)
+        if min_score is not None:
+            peaks = [peak for peak in peaks if peak[1] >= min_score - COARSE_SLACK]
+        factor = 2 ** level
+        if not peaks:
+            (x, y), score = top_peaks(scores, 1, size)[0]
+            return Match((x * factor + offset[0], y * factor + offset[1]),
+                         score, scale, template_levels[0].shape[1::-1])
+        return refine_peaks(image, template_levels[0], peaks, factor, scale, offset, mask=mask,
+                            template_mask=self.masks[index])
+
+    def _detect_entry(self, index, level, image, offset, level_image, image_spectra, energy, min_score, mask):
+        """Every Match of entry index scoring at least min_score"""
+        name, scale, template_levels = self.entries[index]
+        scores = self._scores(index, level, level_image, image_spectra, energy)
+        size = template_levels[level].shape[1::-1]
+        if mask is not None:
+            mask.apply(scores, template_levels[0].shape[1::-1], 2 ** level, offset)
+        if level == 0:
+            peaks = [peak for peak in top_peaks(scores, DETECT_CANDIDATES, size) if peak[1] >= min_score]
+            return [Match((x + offset[0], y + offset[1]), score, scale, size) for (x, y), score in peaks]
+
+        peaks = [peak for peak in top_peaks(scores, DETECT_CANDIDATES, size)
+                 if peak[1] >= min_score - COARSE_SLACK]
+        matches = refine_each(image, template_levels[0], peaks, 2 ** level, scale, offset, mask=mask,
+                              template_mask=self.masks[index])
+        return [match for match in matches if match.score >= min_score]
+
+    def _scan(self, entry_function, image, region, min_score, executor, timeout, mask):
+        """Run entry_function for every template on its pyramid level, [(entry index, result)]"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        region = masked_region(mask, region, image)
+        offset = (0, 0)
+        if region is not None:
+            left, top, right, bottom = region
+            image = image[top:bottom, left:right]
+            offset = (left, top)
+        if not self.entries:
+            return []
+        pyramid = build_pyramid(image, self.levels)
+
+        # Group the templates by the pyramid level they are searched on
+        by_level = {}
+        for index, (name, scale, template_levels) in enumerate(self.entries):
+            full = template_levels[0]
+            if full.shape[0] > image.shape[0] or full.shape[1] > image.shape[1]:
+                continue
+            by_level.setdefault(fitting_level(template_levels, pyramid), []).append(index)
+
+        # Shared per level: the image spectrum and the window statistics of every template size
+        shared = {}
+        for level, indices in by_level.items():
+            level_image = pyramid[level]
+            height, width = level_image.shape[:2]
+            # Circular correlation only wraps outside the valid result area, so
+            # no padding beyond a fast DFT size is needed
+            dft_shape = (cv.getOptimalDFTSize(height), cv.getOptimalDFTSize(width))
+            channels = cv.split(level_image)
+            sizes = sorted({self.entries[index][2][level].shape[1::-1] for index in indices})
+            jobs = [(dft_channel, channel, dft_shape) for channel in channels]
+            jobs += [(window_norm, level_image, size) for size in sizes]
+            done = run_jobs(jobs, executor, deadline)
+            if any(result is None for result in done):
+                continue
+            shared[level] = (done[:len(channels)], dict(zip(sizes, done[len(channels):])))
+
+        jobs = []
+        for level, (image_spectra, energies) in shared.items():
+            for index in by_level[level]:
+                size = self.entries[index][2][level].shape[1::-1]
+                jobs.append((entry_function, index, level, image, offset, pyramid[level],
+                             image_spectra, energies[size], min_score, mask))
+        return [(job[1], result) for job, result in zip(jobs, run_jobs(jobs, executor, deadline))]
+
+    def match_all(self, image, region=None, min_score=None, executor=None, timeout=None, mask=None):
+        """Best Match of every template in image as {name: Match or None}.
+
+        With several scales the best scoring scale is kept per name.
+        region restricts the search to a (left, top, right, bottom) box.
+        With min_score, coarse peaks more than COARSE_SLACK below it are
+        not refined at full resolution; such templates report their coarse
+        location and score, which is enough to know they did not match.
+        With a sight.executor.VisionExecutor the templates are matched in
+        parallel, and those not done within timeout seconds give None.
+        Matches a sight.search_mask.SearchMask excludes are never returned.
+        """
+        results = {name: None for name, scale, levels in self.entries}
+        for index, found in self._scan(self._match_entry, image, region, min_score, executor, timeout, mask):
+            name = self.entries[index][0]
+            best = results[name]
+            if found is not None and (best is None or found.score > best.score):
+                results[name] = found
+        return results
+
+    def detect_all(self, image, min_score, region=None, executor=None, timeout=None, overlap=NMS_OVERLAP,
+                   mask=None):
+        """Every object scoring at least min_score, as Detections sorted best first.
+
+        Each template contributes up to DETECT_CANDIDATES matches; matches of
+        any template that overlap a better one are removed with
+        non_max_suppression(), so one mob is reported once.
+        """
+        matches = []
+        for index, found in self._scan(self._detect_entry, image, region, min_score, executor, timeout, mask):
+            if found:
+                name = self.entries[index][0]
+                matches += [(name, match) for match in found]
+        if not matches:
+            return []
+        boxes = [(m.location[0], m.location[1], m.location[0] + m.size[0], m.location[1] + m.size[1])
+                 for name, m in matches]
+        scores = np.array([m.score for name, m in matches])
+        return [Detection(matches[i][0], tuple(boxes[i]), float(scores[i]))
+                for i in non_max_suppression(boxes, scores, overlap)]
@@ -0,0 +1,78 @@
+import time
+from collections import deque
+from threading import Lock
+
+
+# Capture rate when no agent asks for anything faster
+IDLE_FPS = 5
+# Frames kept for the rolling FPS / jitter report
+FPS_WINDOW = 120
+
+
+class FramePacer:
+    """Deadline-based pacing of the capture loop.
+
+    Agents request a target frame rate under their own name and the pacer
+    runs at the highest one requested, falling back to default_fps. Frames
+    are scheduled on fixed deadlines instead of "sleep after the work", so
+    capture time does not add to the frame period; when the loop falls
+    more than a period behind it starts again from now rather than
+    bursting to catch up.
+    """
+
+    def __init__(self, default_fps=IDLE_FPS):
+        self.default_fps = default_fps
+        self._requests = {}
+        self._lock = Lock()
+        self._deadline = None
+
+    def request(self, owner, fps):
+        """Ask for at least fps frames per second until released"""
+        with self._lock:
+            self._requests[owner] = fps
+
+    def release(self, owner):
+        with self._lock:
+            self._requests.pop(owner, None)
+
+    @property
+    def target_fps(self):
+        with self._lock:
+            if self._requests:
+                return max(self._requests.values())
+        return self.default_fps
+
+    def wait(self):
+        """Sleep until the next frame is due"""
+        period = 1 / self.target_fps
+        now = time.perf_counter()
+        if self._deadline is None or now - self._deadline > period:
+            self._deadline = now
+        self._deadline += period
+        delay = self._deadline - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FpsMeter:
+    """Rolling-window frame rate and frame interval jitter"""
+
+    def __init__(self, window=FPS_WINDOW):
+        self._times = deque(maxlen=window)
+
+    def tick(self, timestamp=None):
+        self._times.append(time.perf_counter() if timestamp is None else timestamp)
+
+    def fps(self):
+        if len(self._times) < 2:
+            return 0.0
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+    def jitter(self):
+        """Standard deviation of the frame intervals in seconds"""
+        if len(self._times) < 3:
+            return 0.0
+        times = list(self._times)
+        intervals = [b - a for a, b in zip(times, times[1:])]
+        mean = sum(intervals) / len(intervals)
+        return (sum((i - mean) ** 2 for i in intervals) / len(intervals)) ** 0.5
@@ -0,0 +1,141 @@
+import time
+
+import numpy as np
+import cv2 as cv
+
+from sight.matching import remaining
+from sight.regions import merge_regions
+
+
+# Proposals are found on the frame shrunk by this factor
+PROPOSAL_FACTOR = 4
+# Hue and saturation bins of the colour histograms
+HIST_BINS = [30, 32]
+HIST_RANGES = [0, 180, 0, 256]
+# Back-projection (0 - 255) a pixel needs to count as object coloured
+PROPOSAL_THRESHOLD = 128
+# Smallest blob kept, as a fraction of the smallest template's area
+PROPOSAL_MIN_FILL = 0.05
+# When the proposals cover more than this fraction of the search area,
+# the scene is not sparse and one full search is cheaper than many small ones
+PROPOSAL_MAX_COVER = 0.5
+
+
+def _template_image(template):
+    """(BGR image, mask or None) of a sight.templates.Template or a plain image"""
+    if hasattr(template, "image"):
+        return template.image, template.mask
+    if template.ndim == 3 and template.shape[2] == 4:
+        return template[:, :, :3], np.where(template[:, :, 3] > 0, 255, 0).astype(np.uint8)
+    return template, None
+
+
+class ColorProposals:
+    """Cheap first stage that tells the template matchers where to look.
+
+    The hue/saturation histograms of the templates are back-projected onto
+    a shrunk copy of the frame, as a ratio to the frame's own histogram so
+    colours the whole scene is made of (grass, water) do not light up.
+    Pixels inside any of the HSV ranges, e.g. red enemy nameplates, count
+    too. Blobs of such pixels, grown by the template size and merged, are
+    the regions worth a full template search.
+    """
+
+    def __init__(self, templates, scales=(1.0,), ranges=(), factor=PROPOSAL_FACTOR,
+                 threshold=PROPOSAL_THRESHOLD, min_fill=PROPOSAL_MIN_FILL, max_cover=PROPOSAL_MAX_COVER):
+        self.ranges = [(np.array(lower, np.uint8), np.array(upper, np.uint8)) for lower, upper in ranges]
+        self.factor = factor
+        self.threshold = threshold
+        self.max_cover = max_cover
+
+        self.histogram = np.zeros(HIST_BINS, np.float32)
+        sizes = []
+        for template in templates:
+            image, mask = _template_image(template)
+            hsv = cv.cvtColor(image, cv.COLOR_BGR2HSV)
+            self.histogram += cv.calcHist([hsv], [0, 1], mask, HIST_BINS, HIST_RANGES)
+            sizes.append(image.shape[1::-1])
+        if self.histogram.sum() > 0:
+            self.histogram /= self.histogram.sum()
+        # Largest object size in pixels, and the smallest blob worth a look in shrunk pixels
+        self.object_size = (int(max(w for w, h in sizes) * max(scales)) if sizes else 0,
+                            int(max(h for w, h in sizes) * max(scales)) if sizes else 0)
+        smallest = min(w * h for w, h in sizes) * min(scales) ** 2 if sizes else 0
+        self.min_area = max(1, int(smallest * min_fill / factor ** 2))
+
+    def hits(self, image):
+        """0/255 map of the object coloured pixels of a (shrunk) BGR image"""
+        hsv = cv.cvtColor(image, cv.COLOR_BGR2HSV)
+        hits = np.zeros(hsv.shape[:2], np.uint8)
+        if self.histogram.any():
+            scene = cv.calcHist([hsv], [0, 1], None, HIST_BINS, HIST_RANGES)
+            scene /= max(scene.sum(), 1)
+            ratio = np.minimum(self.histogram / np.maximum(scene, 1e-9), 1.0) * 255
+            projection = cv.calcBackProject([hsv], [0, 1], ratio.astype(np.float32), HIST_RANGES, 1)
+            hits[projection >= self.threshold] = 255
+        for lower, upper in self.ranges:
+            hits |= cv.inRange(hsv, lower, upper)
+        # Join the speckles of one object into a single blob
+        return cv.morphologyEx(hits, cv.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+
+    def propose(self, image, region=None, mask=None):
+        """(left, top, right, bottom) regions of image worth a template search.
+
+        Blobs a sight.search_mask.SearchMask excludes are left out. Returns
+        None when the regions would cover most of the search area anyway,
+        meaning: search all of it.
+        """
+        height, width = image.shape[:2]
+        if mask is not None:
+            region = mask.crop(region)
+        left, top, right, bottom = region if region is not None else (0, 0, width, height)
+        if right - left < self.factor or bottom - top < self.factor:
+            return []
+        small = cv.resize(image[top:bottom, left:right], None, fx=1 / self.factor, fy=1 / self.factor,
+                          interpolation=cv.INTER_AREA)
+        count, labels, stats, centroids = cv.connectedComponentsWithStats(self.hits(small), connectivity=8)
+
+        o_width, o_height = self.object_size
+        boxes = []
+        for x, y, w, h, area in stats[1:].tolist():
+            if area < self.min_area:
+                continue
+            if mask is not None and not mask.contains((left + x * self.factor, top + y * self.factor),
+                                                      (w * self.factor, h * self.factor)):
+                continue
+            # The blob may be any part of the object, leave room for all of it
+            boxes.append((max(left + x * self.factor - o_width, left),
+                          max(top + y * self.factor - o_height, top),
+                          min(left + (x + w) * self.factor + o_width, right),
+                          min(top + (y + h) * self.factor + o_height, bottom)))
+        proposals = merge_regions(boxes)
+        covered = sum((r - l) * (b - t) for l, t, r, b in proposals)
+        if covered > self.max_cover * (right - left) * (bottom - top):
+            return None
+        return proposals
+
+
+def match_proposals(matcher, image, template, proposals, executor=None, timeout=None, mask=None):
+    """Best sight.matching Match of template within the proposals (None: the whole image)"""
+    if proposals is None:
+        return matcher.match(image, template, executor=executor, timeout=timeout, mask=mask)
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    best = None
+    for region in proposals:
+        match = matcher.match(image, template, region, executor=executor, timeout=remaining(deadline), mask=mask)
+        if match is not None and (best is None or match.score > best.score):
+            best = match
+    return best
+
+
+def detect_proposals(batch, image, min_score, proposals, executor=None, timeout=None, mask=None):
+    """Every sight.matching Detection of a TemplateBatch within the proposals (None: the whole image)"""
+    if proposals is None:
+        return batch.detect_all(image, min_score, executor=executor, timeout=timeout, mask=mask)
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    detections = []
+    # merge_regions leaves no two proposals overlapping, so no object is reported twice
+    for region in proposals:
+        detections += batch.detect_all(image, min_score, region, executor, remaining(deadline), mask=mask)
+    detections.sort(key=lambda detection: detection.score, reverse=True)
+    return detections
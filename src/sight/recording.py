@@ -0,0 +1,229 @@
+import json
+import mmap
+import struct
+import time
+import zlib
+from threading import Event, Lock
+
+import numpy as np
+
+from sight.capture import CaptureBackend
+
+
+# File layout: FILE_MAGIC, then a sequence of chunks. Every chunk starts with
+# CHUNK_HEADER: kind, frame id, timestamp, height, width, channels, colour
+# order, compression and payload size. Frame payloads are raw (or zlib
+# compressed) pixels, event payloads are UTF-8 JSON.
+FILE_MAGIC = b'WZREC001'
+CHUNK_HEADER = struct.Struct('<4sQdIIB4sBQ')
+FRAME_CHUNK = b'FRAM'
+EVENT_CHUNK = b'EVNT'
+
+RAW = 0
+ZLIB = 1
+
+
+class FrameRecorder:
+    """Streams captured frames and events (key presses, labels) to a recording file.
+
+    Events may come from any thread; chunks are written whole under a lock.
+    """
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        self.frames = 0
+        self._lock = Lock()
+        self._file = open(path, 'wb')
+        self._file.write(FILE_MAGIC)
+
+    def write_frame(self, frame):
+        """Append a published sight.frame_store.Frame"""
+        image = np.ascontiguousarray(frame.image)
+        height, width, channels = image.shape
+        payload = memoryview(image).cast('B')
+        compression = RAW
+        if self.compress:
+            payload = zlib.compress(payload, 1)
+            compression = ZLIB
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(CHUNK_HEADER.pack(
+                FRAME_CHUNK, frame.frame_id, frame.timestamp, height, width, channels,
+                frame.color_order.encode().ljust(4), compression, len(payload)))
+            self._file.write(payload)
+            self.frames += 1
+
+    def write_event(self, name, timestamp=None, **data):
+        """Append an event, e.g. an input action or a "bite" label"""
+        if timestamp is None:
+            timestamp = time.time()
+        payload = json.dumps(dict(data, name=name)).encode()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(CHUNK_HEADER.pack(
+                EVENT_CHUNK, 0, timestamp, 0, 0, 0, b'    ', RAW, len(payload)))
+            self._file.write(payload)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                print(f"Recorded {self.frames} frames to {self.path}")
+
+
+class RecordedFrame:
+    """Index entry of one frame in a recording"""
+
+    def __init__(self, frame_id, timestamp, shape, color_order, compression, offset, size):
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.shape = shape
+        self.color_order = color_order
+        self.compression = compression
+        self.offset = offset
+        self.size = size
+
+
+class Recording:
+    """Memory-mapped read access to a recording file.
+
+    Opening a recording only walks the chunk headers; raw frames are
+    returned as zero-copy views into the mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"{path} is not a wowzer recording")
+        self.frames = []
+        self.events = []
+        self._index()
+
+    def _index(self):
+        offset = len(FILE_MAGIC)
+        end = len(self._map)
+        while offset + CHUNK_HEADER.size <= end:
+            kind, frame_id, timestamp, height, width, channels, color_order, compression, size = \
+                CHUNK_HEADER.unpack_from(self._map, offset)
+            offset += CHUNK_HEADER.size
+            if offset + size > end:
+                print(f"Warning: truncated chunk at the end of {self.path}")
+                break
+            if kind == FRAME_CHUNK:
+                self.frames.append(RecordedFrame(
+                    frame_id, timestamp, (height, width, channels),
+                    color_order.decode().strip(), compression, offset, size))
+            elif kind == EVENT_CHUNK:
+                event = json.loads(bytes(self._map[offset:offset + size]))
+                event['timestamp'] = timestamp
+                self.events.append(event)
+            offset += size
+
+    def __len__(self):
+        return len(self.frames)
+
+    def image(self, index):
+        """Pixels of frame number index (a read-only view for raw frames)"""
+        entry = self.frames[index]
+        if entry.compression == ZLIB:
+            data = zlib.decompress(self._map[entry.offset:entry.offset + entry.size])
+            return np.frombuffer(data, dtype=np.uint8).reshape(entry.shape)
+        return np.frombuffer(self._map, dtype=np.uint8, count=entry.size,
+                             offset=entry.offset).reshape(entry.shape)
+
+    def events_named(self, name):
+        return [event for event in self.events if event['name'] == name]
+
+    def close(self):
+        """Close the file; while frames returned by image() are still in use, the map stays open"""
+        try:
+            self._map.close()
+        except BufferError:
+            # Views of raw frames are still referenced (e.g. by a FrameStore),
+            # the map is released together with the last of them
+            pass
+        self._file.close()
+
+
+class RecordingCapture(CaptureBackend):
+    """Capture backend that feeds a recording back in at real or accelerated speed.
+
+    speed 1.0 reproduces the recorded frame timing, 4.0 plays four times as
+    fast and 0 plays as fast as the consumers allow. The backend paces
+    itself, so the capture loop does not add its own frame pacing.
+
+    With paused, only the first frame is delivered until play() is called,
+    so an agent that takes a while to start sees the recording from the
+    start instead of joining it halfway.
+    """
+    name = "recording"
+    self_paced = True
+
+    def __init__(self, path, speed=1.0, loop=False, paused=False):
+        self.recording = Recording(path)
+        if not len(self.recording):
+            raise ValueError(f"{path} contains no frames")
+        self.speed = speed
+        self.loop = loop
+        self.index = 0
+        first = self.recording.frames[0]
+        self.color_order = first.color_order
+        self.channels = first.shape[2]
+        self._start_wall = None
+        self._start_recorded = first.timestamp
+        self._current = None
+        self._playing = Event()
+        if not paused:
+            self._playing.set()
+
+    def play(self):
+        """Deliver the frames after the first one, timed from now"""
+        self._start_wall = None
+        self._playing.set()
+
+    def size(self):
+        height, width = self.recording.frames[0].shape[:2]
+        return (width, height)
+
+    def begin_frame(self):
+        if self.index >= len(self.recording):
+            if not self.loop:
+                raise EOFError(f"End of recording {self.recording.path}")
+            self.index = 0
+            self._start_wall = None
+        if self.index > 0:
+            self._playing.wait()
+        entry = self.recording.frames[self.index]
+
+        now = time.perf_counter()
+        if self._start_wall is None:
+            self._start_wall = now
+            self._start_recorded = entry.timestamp
+        if self.speed > 0:
+            due = self._start_wall + (entry.timestamp - self._start_recorded) / self.speed
+            if due > now:
+                time.sleep(due - now)
+
+        self.index += 1
+        self._current = self.recording.image(self.index - 1)
+
+    def grab(self, bbox=None):
+        if self._current is None:
+            self.begin_frame()
+        image = self._current
+        if bbox is not None:
+            left, top, right, bottom = bbox
+            image = image[top:bottom, left:right]
+        return image
+
+    def grab_into(self, dst, bbox=None):
+        np.copyto(dst, self.grab(bbox))
+        return dst
+
+    def close(self):
+        self.recording.close()
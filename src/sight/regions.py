@@ -0,0 +1,75 @@
+from threading import Lock
+
+
+def screen_region(screen_size, left, top, right, bottom):
+    """Convert a fractional (0.0 - 1.0) rectangle into a pixel bbox for the given screen size"""
+    width, height = screen_size
+    return (int(left * width), int(top * height), int(right * width), int(bottom * height))
+
+
+def merge_regions(regions):
+    """Merge overlapping or touching (left, top, right, bottom) rectangles"""
+    merged = [tuple(region) for region in regions]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        while merged:
+            cur = merged.pop()
+            i = 0
+            while i < len(merged):
+                other = merged[i]
+                if cur[0] <= other[2] and other[0] <= cur[2] and cur[1] <= other[3] and other[1] <= cur[3]:
+                    cur = (min(cur[0], other[0]), min(cur[1], other[1]),
+                           max(cur[2], other[2]), max(cur[3], other[3]))
+                    merged.pop(i)
+                    changed = True
+                else:
+                    i += 1
+            result.append(cur)
+        merged = result
+    return sorted(merged)
+
+
+class CaptureRegions:
+    """Screen regions the agents need, used by the capture thread in ROI mode"""
+
+    def __init__(self):
+        self._regions = {}
+        self._lock = Lock()
+        self._merged = None
+
+    def register(self, name, bbox):
+        """Register (or replace) the (left, top, right, bottom) region called name"""
+        left, top, right, bottom = (int(v) for v in bbox)
+        if right <= left or bottom <= top:
+            print(f"Warning: ignoring empty capture region {name}: {bbox}")
+            return
+        with self._lock:
+            self._regions[name] = (left, top, right, bottom)
+            self._merged = None
+
+    def unregister(self, name):
+        with self._lock:
+            if self._regions.pop(name, None) is not None:
+                self._merged = None
+
+    def merged(self, screen_size=None):
+        """Return the registered regions merged and clipped to the screen"""
+        with self._lock:
+            if self._merged is None:
+                self._merged = merge_regions(self._regions.values())
+            regions = self._merged
+        if screen_size is None:
+            return list(regions)
+        width, height = screen_size
+        clipped = []
+        for left, top, right, bottom in regions:
+            left, top = max(left, 0), max(top, 0)
+            right, bottom = min(right, width), min(bottom, height)
+            if right > left and bottom > top:
+                clipped.append((left, top, right, bottom))
+        return clipped
+
+    def __len__(self):
+        return len(self._regions)
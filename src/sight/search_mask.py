@@ -0,0 +1,105 @@
+from threading import Lock
+
+import numpy as np
+
+from sight.regions import screen_region
+
+
+# Default UI layout: screen parts (as fractions) covered by UI chrome, where
+# no mob, bobber or corpse can appear but look-alikes produce false matches
+UI_EXCLUSIONS = {
+    "unit_frames": (0.0, 0.0, 0.25, 0.12),
+    "minimap": (0.86, 0.0, 1.0, 0.22),
+    "chat": (0.0, 0.65, 0.28, 0.88),
+    "action_bars": (0.25, 0.9, 0.75, 1.0),
+}
+# Extra exclusions per zone, e.g. {"Feralas": [(0.0, 0.0, 1.0, 0.1)]} for a
+# skyline that often matches the bobber
+ZONE_EXCLUSIONS = {}
+# Exclusions in pixels for one resolution, e.g. {(2560, 1440): [(0, 1300, 600, 1440)]}
+# for a UI laid out differently at that size
+RESOLUTION_EXCLUSIONS = {}
+
+
+class SearchMask:
+    """Screen areas the matchers may report objects in.
+
+    A match only counts when its centre lies outside every exclusion
+    rectangle. Matchers also crop their search to bounds, the box around
+    everything still allowed.
+    """
+
+    def __init__(self, screen_size, exclusions):
+        width, height = screen_size
+        self.size = screen_size
+        self.exclusions = list(exclusions)
+        self.mask = np.full((height, width), True)
+        for left, top, right, bottom in self.exclusions:
+            self.mask[max(top, 0):bottom, max(left, 0):right] = False
+        rows = np.flatnonzero(self.mask.any(axis=1))
+        columns = np.flatnonzero(self.mask.any(axis=0))
+        if rows.size:
+            self.bounds = (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+        else:
+            self.bounds = (0, 0, 0, 0)
+
+    def excluded_fraction(self):
+        return 1 - self.mask.mean()
+
+    def contains(self, location, size):
+        """Whether an object of size (width, height) at top-left location is allowed"""
+        x = int(location[0] + size[0] // 2)
+        y = int(location[1] + size[1] // 2)
+        height, width = self.mask.shape
+        return 0 <= x < width and 0 <= y < height and bool(self.mask[y, x])
+
+    def allowed(self, result_shape, size, factor=1, offset=(0, 0)):
+        """Boolean map of the allowed positions in a matchTemplate result.
+
+        The result was computed at 1 / factor of the screen for a template
+        of full-size size (width, height), over an image starting at offset.
+        """
+        rows, columns = result_shape[:2]
+        height, width = self.mask.shape
+        ys = np.clip(offset[1] + np.arange(rows) * factor + size[1] // 2, 0, height - 1)
+        xs = np.clip(offset[0] + np.arange(columns) * factor + size[0] // 2, 0, width - 1)
+        return self.mask[np.ix_(ys, xs)]
+
+    def apply(self, result, size, factor=1, offset=(0, 0)):
+        """Set the scores of excluded positions in result to -1, in place"""
+        result[~self.allowed(result.shape, size, factor, offset)] = -1.0
+        return result
+
+    def crop(self, region):
+        """region (or the whole screen for None) cut down to bounds"""
+        if region is None:
+            return self.bounds
+        left, top, right, bottom = region
+        b_left, b_top, b_right, b_bottom = self.bounds
+        return (max(left, b_left), max(top, b_top), min(right, b_right), min(bottom, b_bottom))
+
+
+_masks = {}
+_masks_lock = Lock()
+
+
+def search_mask(zone, screen_size, layout=None):
+    """The SearchMask for a zone at a screen resolution, built once and shared.
+
+    With a sight.ui_layout.UILayout the UI chrome is left out where it was
+    found on screen instead of where UI_EXCLUSIONS expects it.
+    """
+    ui_rects = tuple(layout.exclusions()) if layout is not None else None
+    key = (zone, tuple(screen_size), ui_rects)
+    with _masks_lock:
+        mask = _masks.get(key)
+        if mask is None:
+            if ui_rects is None:
+                exclusions = [screen_region(screen_size, *rect) for rect in UI_EXCLUSIONS.values()]
+            else:
+                exclusions = list(ui_rects)
+            exclusions += [screen_region(screen_size, *rect) for rect in ZONE_EXCLUSIONS.get(zone, [])]
+            exclusions += RESOLUTION_EXCLUSIONS.get(tuple(screen_size), [])
+            mask = SearchMask(screen_size, exclusions)
+            _masks[key] = mask
+        return mask
@@ -0,0 +1,54 @@
+import gc
+import os
+import sys
+
+
+def rss_bytes():
+    """Resident set size of this process in bytes, or None if it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS, in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+    except ImportError:
+        return None
+
+
+class MemoryReport:
+    """Tracks allocation counters between two FPS reports"""
+
+    def __init__(self, frame_store):
+        self.frame_store = frame_store
+        self._allocations = frame_store.allocations
+        self._blocks = sys.getallocatedblocks()
+        self._collections = self._gc_collections()
+
+    @staticmethod
+    def _gc_collections():
+        return sum(stat['collections'] for stat in gc.get_stats())
+
+    def report(self, frames):
+        """One line summary of buffer allocations, Python heap growth, RSS and GC runs"""
+        allocations = self.frame_store.allocations
+        blocks = sys.getallocatedblocks()
+        collections = self._gc_collections()
+        frames = max(frames, 1)
+
+        line = 'buffers: {} (+{:.2f}/frame) | py blocks: {:+.0f}/frame | gc: +{}'.format(
+            allocations,
+            (allocations - self._allocations) / frames,
+            (blocks - self._blocks) / frames,
+            collections - self._collections)
+        rss = rss_bytes()
+        if rss is not None:
+            line += ' | RSS: {:.1f} MB'.format(rss / 1e6)
+
+        self._allocations = allocations
+        self._blocks = blocks
+        self._collections = collections
+        return line
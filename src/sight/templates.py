@@ -0,0 +1,197 @@
+import os
+from threading import Lock
+
+import numpy as np
+import cv2 as cv
+
+from sight.matching import template_pyramid, PYRAMID_LEVELS
+
+
+# File types loaded as templates, compared case-insensitively (Young_Wolf.PNG)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def find_file(path):
+    """path itself if it exists, else a file in the same directory whose name only differs in case"""
+    if os.path.exists(path):
+        return path
+    directory, filename = os.path.split(path)
+    if not os.path.isdir(directory):
+        return None
+    for candidate in os.listdir(directory):
+        if candidate.lower() == filename.lower():
+            return os.path.join(directory, candidate)
+    return None
+
+
+def zone_key(zone):
+    """"Elwynn Forest", "elwynn_forest" and "Elwynn_Forest" all name the same zone folder"""
+    return zone.lower().replace(' ', '_')
+
+
+class Template:
+    """A template image plus everything the matchers derive from it, computed once.
+
+    image is BGR, gray its grayscale version and mask a 0/255 mask built
+    from the alpha channel (None for images without transparent pixels,
+    which match in full). The matchers and colour proposals only look at
+    the pixels the mask keeps; elsewhere image holds their mean colour.
+    mean and std are the per-channel statistics of the kept pixels.
+    Scaled and downsampled pyramids and scaled masks are built on first
+    use and kept.
+    """
+
+    def __init__(self, name, path, image):
+        self.name = name
+        self.path = path
+        self.mask = None
+        if image.ndim == 3 and image.shape[2] == 4:
+            if (image[:, :, 3] == 0).any():
+                self.mask = np.where(image[:, :, 3] > 0, 255, 0).astype(np.uint8)
+            image = cv.cvtColor(image, cv.COLOR_BGRA2BGR)
+            if self.mask is not None:
+                # Transparent pixels take the mean colour of the others, so the
+                # unmasked coarse and batch searches hardly score them
+                image[self.mask == 0] = cv.mean(image, mask=self.mask)[:3]
+        elif image.ndim == 2:
+            image = cv.cvtColor(image, cv.COLOR_GRAY2BGR)
+        self.image = image
+        self.gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+        mean, std = cv.meanStdDev(image, mask=self.mask)
+        self.mean = mean.ravel()
+        self.std = std.ravel()
+        self._pyramids = {}
+        self._masks = {}
+
+    @classmethod
+    def from_arrays(cls, name, path, image, gray, mask, mean, std, pyramids):
+        """Template from variants computed earlier, e.g. views into a sight.asset_bundle"""
+        template = cls.__new__(cls)
+        template.name = name
+        template.path = path
+        template.image = image
+        template.gray = gray
+        template.mask = mask
+        template.mean = mean
+        template.std = std
+        template._pyramids = dict(pyramids)
+        template._masks = {}
+        return template
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def pyramid(self, scale=1.0, levels=PYRAMID_LEVELS):
+        """[template at scale, / 2, / 4, ...], see sight.matching.template_pyramid"""
+        key = (scale, levels)
+        pyramid = self._pyramids.get(key)
+        if pyramid is None:
+            pyramid = template_pyramid(self.image, scale, levels)
+            self._pyramids[key] = pyramid
+        return pyramid
+
+    def scaled_mask(self, scale=1.0):
+        """mask at the size of pyramid(scale)[0], None for a template without one"""
+        if self.mask is None:
+            return None
+        mask = self._masks.get(scale)
+        if mask is None:
+            mask = self.mask
+            if scale != 1.0:
+                mask = cv.resize(mask, None, fx=scale, fy=scale, interpolation=cv.INTER_NEAREST)
+            self._masks[scale] = mask
+        return mask
+
+
+class TemplateRegistry:
+    """Process-wide cache of templates, so each asset is read and prepared only once.
+
+    get() loads a single file, group() every image in a directory plus,
+    for a zone, those in the directory's subfolder named after the zone.
+    Zone folders are only read when an agent first asks for that zone.
+    File names are matched case-insensitively.
+
+    When an asset bundle (see sight.asset_bundle, built with
+    `wowzer.py build-assets`) exists, templates are mapped from it and
+    only files added or changed after the build are decoded from disk.
+    """
+
+    def __init__(self, use_bundle=True):
+        self._templates = {}
+        self._groups = {}
+        self._lock = Lock()
+        self._use_bundle = use_bundle
+        self._bundle = None
+        # Image files read from disk and templates mapped from the bundle so far
+        self.loads = 0
+        self.bundled = 0
+
+    def _open_bundle(self):
+        """The asset bundle, opened on first use (None if there is none)"""
+        if self._use_bundle:
+            self._use_bundle = False
+            from sight.asset_bundle import AssetBundle, BUNDLE_PATH
+            if os.path.exists(BUNDLE_PATH):
+                try:
+                    self._bundle = AssetBundle(BUNDLE_PATH)
+                    print(f"Using asset bundle {BUNDLE_PATH} ({len(self._bundle)} templates)")
+                except (OSError, ValueError) as e:
+                    print(f"WARNING: Ignoring asset bundle {BUNDLE_PATH}: {e}")
+        return self._bundle
+
+    def get(self, path, name=None):
+        """Template for the image at path, or None if there is no such file"""
+        with self._lock:
+            return self._get(path, name)
+
+    def _get(self, path, name):
+        key = os.path.normcase(os.path.abspath(path))
+        if key in self._templates:
+            return self._templates[key]
+        found = find_file(path)
+        template = None
+        bundle = self._open_bundle()
+        if found is not None and bundle is not None:
+            template = bundle.template(found)
+            if template is not None:
+                self.bundled += 1
+                if name is not None:
+                    template.name = name
+        if found is not None and template is None:
+            image = cv.imread(found, cv.IMREAD_UNCHANGED)
+            self.loads += 1
+            if image is None:
+                print(f"WARNING: Could not read template image {found}")
+            else:
+                if name is None:
+                    name = os.path.splitext(os.path.basename(found))[0]
+                template = Template(name, found, image)
+        self._templates[key] = template
+        return template
+
+    def group(self, directory, zone=None):
+        """{name: Template} for the images in directory and, with a zone, in its zone folder"""
+        key = (os.path.abspath(directory), zone_key(zone) if zone else None)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = {}
+                folders = [directory]
+                if zone and os.path.isdir(directory):
+                    folders += [os.path.join(directory, entry) for entry in sorted(os.listdir(directory))
+                                if zone_key(entry) == zone_key(zone)]
+                for folder in folders:
+                    if not os.path.isdir(folder):
+                        continue
+                    for filename in sorted(os.listdir(folder)):
+                        if filename.lower().endswith(IMAGE_EXTENSIONS):
+                            template = self._get(os.path.join(folder, filename), None)
+                            if template is not None:
+                                group[template.name] = template
+                self._groups[key] = group
+            return group
+
+
+# Shared by every agent in the process
+registry = TemplateRegistry()
@@ -0,0 +1,86 @@
+import cv2 as cv
+
+from sight.matching import Match, match_template, template_mask, template_pyramid
+
+
+# Pixels searched on every side of the last known location
+TRACK_MARGIN = 24
+# Below this score the object counts as lost and callers fall back to a full search
+TRACK_MIN_SCORE = 0.8
+
+
+class ObjectTracker:
+    """Follows one detected object from frame to frame.
+
+    After a full-frame detection, start() the tracker with the Match; each
+    update() then only searches a window of margin pixels around the last
+    location, a few thousand pixels instead of the whole screen. When the
+    best score in the window drops below min_score the object is lost and
+    update() returns None, which is the caller's cue for a full search.
+    """
+
+    def __init__(self, template, margin=TRACK_MARGIN, min_score=TRACK_MIN_SCORE):
+        self.template = template
+        self.margin = margin
+        self.min_score = min_score
+        self.match = None
+        self._image = None
+        self._mask = None
+
+    @property
+    def tracking(self):
+        return self.match is not None
+
+    @property
+    def location(self):
+        return self.match.location if self.match is not None else None
+
+    def start(self, match):
+        """Track the object found by a sight.matching Match"""
+        if hasattr(self.template, "pyramid"):
+            self._image = self.template.pyramid(match.scale)[0]
+        else:
+            self._image = template_pyramid(self.template, match.scale, 0)[0]
+        self._mask = template_mask(self.template, match.scale)
+        self.match = match
+
+    def reset(self):
+        self.match = None
+
+    def window(self):
+        """(left, top, right, bottom) update() searches next, None when nothing is tracked"""
+        if self.match is None:
+            return None
+        x, y = self.match.location
+        t_height, t_width = self._image.shape[:2]
+        return (x - self.margin, y - self.margin, x + t_width + self.margin, y + t_height + self.margin)
+
+    def update(self, image, mask=None):
+        """Re-find the object near its last location, None once it is lost.
+
+        image is a BGR array or a sight.frame_store.Frame, of which only the
+        search window gets converted. An object drifting into an area a
+        sight.search_mask.SearchMask excludes counts as lost too.
+        """
+        if self.match is None:
+            return None
+        t_height, t_width = self._image.shape[:2]
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = self.window()
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if x1 - x0 < t_width or y1 - y0 < t_height:
+            self.match = None
+            return None
+
+        if hasattr(image, "convert"):
+            window = image.convert("bgr", (x0, y0, x1, y1))
+        else:
+            window = image[y0:y1, x0:x1]
+        result = match_template(window, self._image, self._mask)
+        min_val, max_val, min_loc, max_loc = cv.minMaxLoc(result)
+        location = (max_loc[0] + x0, max_loc[1] + y0)
+        if not max_val >= self.min_score or (mask is not None and not mask.contains(location, (t_width, t_height))):
+            self.match = None
+            return None
+        self.match = Match(location, max_val, self.match.scale, (t_width, t_height))
+        return self.match
@@ -0,0 +1,247 @@
+import json
+import os
+
+import numpy as np
+import cv2 as cv
+
+from sight.matching import TemplateMatcher
+from sight.regions import screen_region
+from sight.search_mask import UI_EXCLUSIONS
+from sight.templates import registry
+from sight.ui_state import UI_LAYOUT
+
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+UI_ASSETS = os.path.join(SRC_PATH, "grinding", "assets", "ui")
+# Layouts found so far, one per resolution and UI scale
+LAYOUT_PATH = os.path.join(SRC_PATH, "ui_layout.json")
+
+# The player unit frame anchors the unit frames; UI_LAYOUT assumes it at
+# this top-left corner at UI scale 1.0
+PLAYER_FRAME = os.path.join(UI_ASSETS, "in_combat.PNG")
+PLAYER_FRAME_ORIGIN = (10, 10)
+# Optional screenshots of the other UI elements; without one the element
+# keeps its default place from sight.search_mask.UI_EXCLUSIONS
+UI_TEMPLATES = {
+    "minimap": os.path.join(UI_ASSETS, "minimap.PNG"),
+    "chat": os.path.join(UI_ASSETS, "chat.PNG"),
+    "action_bars": os.path.join(UI_ASSETS, "action_bar.PNG"),
+}
+# In-game UI scales tried (the game allows 0.64 - 1.15)
+UI_SCALES = np.round(np.arange(0.65, 1.16, 0.05), 2)
+# Score a UI element must reach to count as found
+LAYOUT_MIN_SCORE = 0.8
+# Pixels around a cached player frame searched to confirm the layout still holds
+VERIFY_MARGIN = 8
+# Minimap radius range as fractions of the screen height, when it is found as a circle
+MINIMAP_RADII = (0.04, 0.12)
+
+
+def layout_key(screen_size, ui_scale):
+    return f"{screen_size[0]}x{screen_size[1]}@{ui_scale:.2f}"
+
+
+def _grow(region, margin, screen_size):
+    """region widened by margin pixels on each side, kept on screen"""
+    left, top, right, bottom = region
+    return (max(left - margin, 0), max(top - margin, 0),
+            min(right + margin, screen_size[0]), min(bottom + margin, screen_size[1]))
+
+
+def _bounds(rects):
+    return (min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects))
+
+
+class UILayout:
+    """Where the UI elements are for one resolution and UI scale.
+
+    elements maps names to (left, top, right, bottom) pixel rectangles:
+    the player_frame, the UI_LAYOUT regions sight.ui_state reads and the
+    UI_EXCLUSIONS areas the search masks leave out. minimap is its
+    (centre x, centre y, radius). found lists the elements located on
+    screen rather than placed by default.
+    """
+
+    def __init__(self, screen_size, ui_scale, elements, minimap=None, found=()):
+        self.screen_size = tuple(screen_size)
+        self.ui_scale = float(ui_scale)
+        self.elements = {name: tuple(int(v) for v in rect) for name, rect in elements.items()}
+        self.minimap = tuple(int(v) for v in minimap) if minimap else None
+        self.found = list(found)
+
+    @property
+    def key(self):
+        return layout_key(self.screen_size, self.ui_scale)
+
+    def state_regions(self):
+        """Regions for sight.ui_state.UIStateReader"""
+        return {name: self.elements[name] for name in UI_LAYOUT}
+
+    def exclusions(self):
+        """Pixel rectangles for sight.search_mask.SearchMask"""
+        return [self.elements[name] for name in UI_EXCLUSIONS]
+
+    def to_dict(self):
+        return {"screen_size": list(self.screen_size), "ui_scale": self.ui_scale,
+                "elements": {name: list(rect) for name, rect in self.elements.items()},
+                "minimap": list(self.minimap) if self.minimap else None, "found": self.found}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["screen_size"], data["ui_scale"], data["elements"], data.get("minimap"),
+                   data.get("found", ()))
+
+    def __repr__(self):
+        return f"UILayout({self.key}, found {', '.join(self.found) or 'nothing'})"
+
+
+def default_layout(screen_size, ui_scale=1.0, origin=PLAYER_FRAME_ORIGIN):
+    """The layout of an untouched UI: unit frames from UI_LAYOUT, the rest from UI_EXCLUSIONS"""
+    elements = {name: screen_region(screen_size, *rect) for name, rect in UI_EXCLUSIONS.items()}
+    elements.update(unit_frames(origin, ui_scale))
+    left, top, right, bottom = elements["minimap"]
+    minimap = ((left + right) // 2, (top + bottom) // 2, min(right - left, bottom - top) // 2)
+    return UILayout(screen_size, ui_scale, elements, minimap)
+
+
+def unit_frames(origin, ui_scale):
+    """Unit frame regions for a player frame at top-left origin, UI_LAYOUT scaled by ui_scale"""
+    x, y = origin
+    o_x, o_y = PLAYER_FRAME_ORIGIN
+    template = registry.get(PLAYER_FRAME)
+    width, height = template.shape[1::-1] if template is not None else (0, 0)
+    elements = {"player_frame": (x, y, x + round(width * ui_scale), y + round(height * ui_scale))}
+    for name, (left, top, right, bottom) in UI_LAYOUT.items():
+        elements[name] = (x + round((left - o_x) * ui_scale), y + round((top - o_y) * ui_scale),
+                          x + round((right - o_x) * ui_scale), y + round((bottom - o_y) * ui_scale))
+    elements["unit_frames"] = _bounds(list(elements.values()))
+    return elements
+
+
+def find_player_frame(gray, scales=UI_SCALES, region=None):
+    """sight.matching Match of the player unit frame in a grayscale screen, None if it is not there.
+
+    Grayscale, because the name plate is red in combat only.
+    """
+    template = registry.get(PLAYER_FRAME)
+    if template is None:
+        return None
+    height, width = gray.shape[:2]
+    if region is None:
+        # Unit frames sit in the top-left part of the screen
+        region = (0, 0, width // 2, height // 2)
+    match = TemplateMatcher(scales).match(gray, template.gray, region)
+    if match is None or match.score < LAYOUT_MIN_SCORE:
+        return None
+    return match
+
+
+def find_element(gray, name, ui_scale, region):
+    """(left, top, right, bottom) of a UI_TEMPLATES element in region, None without a template or match"""
+    template = registry.get(UI_TEMPLATES[name])
+    if template is None:
+        return None
+    match = TemplateMatcher((ui_scale,)).match(gray, template.gray, region)
+    if match is None or match.score < LAYOUT_MIN_SCORE:
+        return None
+    (x, y), (w, h) = match.location, match.size
+    return (x, y, x + w, y + h)
+
+
+def find_minimap(gray, region):
+    """(centre x, centre y, radius) of the round minimap in region, None if there is no circle"""
+    left, top, right, bottom = region
+    height = gray.shape[0]
+    patch = cv.medianBlur(np.ascontiguousarray(gray[top:bottom, left:right]), 5)
+    low, high = (int(height * fraction) for fraction in MINIMAP_RADII)
+    circles = cv.HoughCircles(patch, cv.HOUGH_GRADIENT, dp=1.5, minDist=high, param1=100, param2=40,
+                              minRadius=low, maxRadius=high)
+    if circles is None:
+        return None
+    # HoughCircles lists the strongest circle first
+    x, y, radius = circles[0][0]
+    return (left + int(x), top + int(y), int(radius))
+
+
+def discover_layout(frame):
+    """Locate the UI elements in a sight.frame_store.Frame of the whole screen.
+
+    The player frame is searched at every UI scale, which also tells the
+    scale the other templates are matched at. The minimap is found by its
+    template or else as a circle near its default place.
+    """
+    gray = frame.gray()
+    screen_size = (frame.shape[1], frame.shape[0])
+    match = find_player_frame(gray)
+    if match is None:
+        return default_layout(screen_size)
+
+    layout = default_layout(screen_size, match.scale, match.location)
+    layout.found.append("unit_frames")
+    for name in UI_TEMPLATES:
+        # Look around the default place, the UI can be moved but rarely far
+        default = layout.elements[name]
+        margin = max(default[2] - default[0], default[3] - default[1])
+        region = _grow(default, margin, screen_size)
+        rect = find_element(gray, name, match.scale, region)
+        if rect is None and name == "minimap":
+            circle = find_minimap(gray, region)
+            if circle is not None:
+                x, y, radius = circle
+                layout.minimap = circle
+                # Leave room for the zone name and buttons around the map
+                rect = _grow((x - radius, y - radius, x + radius, y + radius), radius // 4, screen_size)
+        elif rect is not None and name == "minimap":
+            layout.minimap = ((rect[0] + rect[2]) // 2, (rect[1] + rect[3]) // 2,
+                              min(rect[2] - rect[0], rect[3] - rect[1]) // 2)
+        if rect is not None:
+            layout.elements[name] = rect
+            layout.found.append(name)
+    return layout
+
+
+def verify_layout(frame, layout):
+    """Whether the player frame is still where layout has it, at its UI scale"""
+    if "unit_frames" not in layout.found or tuple(layout.screen_size) != (frame.shape[1], frame.shape[0]):
+        return False
+    region = _grow(layout.elements["player_frame"], VERIFY_MARGIN, layout.screen_size)
+    match = find_player_frame(frame.gray(), (layout.ui_scale,), region)
+    return match is not None
+
+
+def load_layouts(path=LAYOUT_PATH):
+    """Layouts saved at path, {} if there are none"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {key: UILayout.from_dict(data) for key, data in json.load(f).items()}
+
+
+def save_layout(layout, path=LAYOUT_PATH):
+    layouts = load_layouts(path)
+    layouts[layout.key] = layout
+    with open(path, 'w') as f:
+        json.dump({key: layout.to_dict() for key, layout in layouts.items()}, f, indent=4, sort_keys=True)
+
+
+def load_layout(frame, refresh=False, path=LAYOUT_PATH):
+    """The UILayout of the screen in frame, from the cache when one still fits.
+
+    Layouts saved for this resolution are checked against the frame, one
+    per UI scale; if none fits (or with refresh) the layout is discovered
+    and saved for next time. Layouts without the player frame are not
+    saved, the UI was probably not showing yet. With path None nothing is
+    read or saved.
+    """
+    if not refresh and path is not None:
+        for layout in load_layouts(path).values():
+            if verify_layout(frame, layout):
+                print(f"Using the saved UI layout {layout.key}")
+                return layout
+    layout = discover_layout(frame)
+    if "unit_frames" in layout.found:
+        print(f"Discovered {layout}")
+        if path is not None:
+            save_layout(layout, path)
+    return layout
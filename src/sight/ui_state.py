@@ -0,0 +1,95 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+# Default UI at UI scale 1.0: pixel rectangles (left, top, right, bottom),
+# measured from the top-left corner of the screen, inside the bars of the
+# player and target unit frames (harness.simulator draws them the same way).
+# sight.ui_layout moves and scales them with the player frame it finds; the
+# bars are not matched against grinding/assets/ui/health_bar.PNG themselves,
+# their fill changes with health and an empty bar would not match.
+UI_LAYOUT = {
+    "combat_flag": (140, 30, 330, 54),      # Player name plate, red while in combat
+    "player_health": (144, 65, 336, 77),
+    "player_mana": (144, 89, 336, 101),
+    "target_health": (534, 65, 726, 77),
+}
+# How much a channel must exceed the other two for a pixel to count as bar
+# coloured (green health, blue mana) or as combat red
+COLOR_MARGIN = 40
+# Share of a column's pixels that must be bar coloured for the column to count as filled
+COLUMN_FILL = 0.5
+# Brightest channel (0 - 255) of the dark, empty part of a bar
+EMPTY_BAR_MAX = 60
+# Share of columns that must be filled or empty for a bar to be there at all
+BAR_PRESENT = 0.9
+# Share of red pixels on the name plate that means in combat
+COMBAT_RED = 0.25
+
+# One frame's worth of player and target state. health, mana and
+# target_health are fractions from 0.0 to 1.0, None where no bar is on screen
+# (for target_health: no target, a dead target still shows an empty bar);
+# in_combat is a bool.
+UIState = namedtuple("UIState", ["frame_id", "timestamp", "health", "mana", "target_health", "in_combat"])
+
+# Channel (B, G, R index) that dominates each bar's colour
+BAR_CHANNELS = {"player_health": 1, "player_mana": 0, "target_health": 1}
+
+
+def dominant(pixels, channel, margin=COLOR_MARGIN):
+    """Boolean map of the BGR pixels whose channel beats both others by margin"""
+    pixels = pixels.astype(np.int16)
+    others = np.maximum(pixels[:, :, (channel + 1) % 3], pixels[:, :, (channel + 2) % 3])
+    return pixels[:, :, channel] > others + margin
+
+
+def bar_fill(pixels, channel):
+    """Filled fraction of a horizontal bar: the share of its columns that are mostly bar coloured.
+
+    None when the pixels are neither bar coloured nor empty bar, i.e. the
+    bar (or the whole unit frame) is not shown.
+    """
+    filled = dominant(pixels, channel).mean(axis=0) >= COLUMN_FILL
+    empty = (pixels.max(axis=2) <= EMPTY_BAR_MAX).mean(axis=0) >= COLUMN_FILL
+    if (filled | empty).mean() < BAR_PRESENT:
+        return None
+    return float(filled.mean())
+
+
+class UIStateReader:
+    """Reads the unit frames into a UIState, one small slice of the frame per value.
+
+    The capture thread calls read() once per frame and publishes the result
+    as MainAgent.ui_state, so agents get health, mana, the target's health
+    and the combat flag without looking at any pixels themselves.
+    """
+
+    def __init__(self, layout=UI_LAYOUT):
+        self.layout = dict(layout)
+
+    @property
+    def bounds(self):
+        """One rectangle around all regions read, for ROI capture"""
+        rects = list(self.layout.values())
+        return (min(r[0] for r in rects), min(r[1] for r in rects),
+                max(r[2] for r in rects), max(r[3] for r in rects))
+
+    def _pixels(self, frame, name):
+        """BGR pixels of a layout region, None unless it lies inside the frame"""
+        left, top, right, bottom = self.layout[name]
+        height, width = frame.shape[:2]
+        if left < 0 or top < 0 or right > width or bottom > height or right <= left or bottom <= top:
+            return None
+        return frame.convert("bgr", (left, top, right, bottom))
+
+    def read(self, frame):
+        """UIState of a sight.frame_store.Frame"""
+        values = {}
+        for name, channel in BAR_CHANNELS.items():
+            pixels = self._pixels(frame, name)
+            values[name] = None if pixels is None else bar_fill(pixels, channel)
+        plate = self._pixels(frame, "combat_flag")
+        in_combat = plate is not None and float(dominant(plate, 2).mean()) >= COMBAT_RED
+        return UIState(frame.frame_id, frame.timestamp, values["player_health"], values["player_mana"],
+                       values["target_health"], in_combat)
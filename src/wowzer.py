@@ -1,5 +1,5 @@
 
-import main
+import argparse
 
 
 APP_NAME = 'wowzer'
@@ -9,7 +9,101 @@ COPYRIGHT_YEAR = '2022'
 WEBSITE_LINK = 'https://github.com/fjpereny/wowzer'
 
 
-def run():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog=APP_NAME)
+    parser.add_argument('--capture', default='pil', help="Capture backend: pil, x11shm or replay")
+    parser.add_argument('--window', default=None, help="Window title to capture (x11shm backend)")
+    parser.add_argument('--replay', default=None, help="Video file or screenshot directory (replay backend)")
+    parser.add_argument('--record', default=None, help="Record every captured frame to this file")
+    parser.add_argument('--compress', action='store_true', help="zlib-compress recorded frames")
+    parser.add_argument('--frame-bus', action='store_true',
+                        help="Share captured frames with other processes through shared memory")
+    parser.add_argument('--bus-name', default='wowzer_frames', help="Shared memory name of the frame bus")
+    commands = parser.add_subparsers(dest='command')
+
+    bench = commands.add_parser('bench-capture', help="Benchmark the available capture backends")
+    bench.add_argument('--frames', type=int, default=100, help="Number of frames to grab per backend")
+
+    replay = commands.add_parser('replay', help="Run an agent on a recording with input logged, not sent")
+    replay.add_argument('recording', help="Recording made with --record")
+    replay.add_argument('--agent', default='fishing', choices=['fishing', 'grinding'])
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help="Playback speed, 0 for as fast as possible (agents keep real-time waits, "
+                             "only 1 replays a session faithfully)")
+    replay.add_argument('--zone', default=None)
+    replay.add_argument('--time', default=None, help="Time of day: day or night")
+
+    bench_vision = commands.add_parser('bench-vision', help="Time the vision functions on a recording")
+    bench_vision.add_argument('recording', help="Recording made with --record")
+    bench_vision.add_argument('--zone', default=None)
+    bench_vision.add_argument('--time', default=None, help="Time of day: day or night")
+
+    simulate = commands.add_parser('simulate', help="Run an agent against the headless game simulator")
+    simulate.add_argument('agent', choices=['fishing', 'grinding'])
+    simulate.add_argument('--duration', type=float, default=300, help="Seconds to run")
+    simulate.add_argument('--seed', type=int, default=None)
+
+    calibrate = commands.add_parser('calibrate-bites', help="Tune bite detection for a zone on recorded fishing")
+    calibrate.add_argument('recordings', nargs='+', help="Recordings with cast/reel events and bite labels")
+    calibrate.add_argument('--zone', required=True)
+    calibrate.add_argument('--time', default=None, help="Time of day: day or night (default: any)")
+    calibrate.add_argument('--max-false-rate', type=float, default=0.05,
+                           help="Largest share of casts allowed to end on a false bite")
+    calibrate.add_argument('--save', action='store_true', help="Save the result to fishing/bite_profiles.json")
+
+    build_assets = commands.add_parser('build-assets', help="Pack all template images into one asset bundle")
+    build_assets.add_argument('--output', default=None, help="Bundle file (default src/assets.wzb)")
+
+    monitor = commands.add_parser('bus-monitor', help="Read frames from a running wowzer's frame bus")
+    monitor.add_argument('--seconds', type=float, default=10, help="Seconds to read for")
+
+    return parser.parse_args(argv)
+
+
+def create_capture_backend(args):
+    from sight.capture import create_backend
+    if args.capture == 'x11shm':
+        return create_backend('x11shm', window_name=args.window)
+    if args.capture == 'replay':
+        return create_backend('replay', path=args.replay)
+    return create_backend(args.capture)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    if args.command == 'bench-capture':
+        from sight.capture import bench_capture
+        bench_capture(args.frames, window_name=args.window, replay_path=args.replay)
+        return
+    if args.command == 'replay':
+        from harness.replay import run_replay
+        run_replay(args.recording, args.agent, args.speed, args.zone, args.time)
+        return
+    if args.command == 'simulate':
+        from harness.simulator import run_simulation
+        recorder = None
+        if args.record is not None:
+            from sight.recording import FrameRecorder
+            recorder = FrameRecorder(args.record, compress=args.compress)
+        run_simulation(args.agent, args.duration, seed=args.seed, recorder=recorder)
+        return
+    if args.command == 'calibrate-bites':
+        from harness.calibrate import calibrate_bites
+        calibrate_bites(args.recordings, args.zone, args.time, args.max_false_rate, args.save)
+        return
+    if args.command == 'build-assets':
+        from sight.asset_bundle import build_bundle, BUNDLE_PATH
+        build_bundle(args.output or BUNDLE_PATH)
+        return
+    if args.command == 'bus-monitor':
+        from sight.frame_bus import monitor_bus
+        monitor_bus(args.bus_name, args.seconds)
+        return
+    if args.command == 'bench-vision':
+        from harness.replay import bench_vision
+        bench_vision(args.recording, args.zone, args.time)
+        return
+
     header_art = "\n\t██╗    ██╗ ██████╗ ██╗    ██╗███████╗███████╗██████╗\n"
     header_art += "\t██║    ██║██╔═══██╗██║    ██║╚══███╔╝██╔════╝██╔══██╗\n"
     header_art += "\t██║ █╗ ██║██║   ██║██║ █╗ ██║  ███╔╝ █████╗  ██████╔╝\n"
@@ -32,7 +126,17 @@ def run():
     header += "* If not, see <https://www.gnu.org/licenses/>.\n"
     header += "******************************************************************************************\n"
     print(header_art, header)
-    main.run()
+
+    import main
+    recorder = None
+    if args.record is not None:
+        from sight.recording import FrameRecorder
+        recorder = FrameRecorder(args.record, compress=args.compress)
+    frame_bus = None
+    if args.frame_bus:
+        from sight.frame_bus import FrameBus
+        frame_bus = FrameBus(args.bus_name)
+    main.run(create_capture_backend(args), recorder, frame_bus)
 
 
 if __name__ == "__main__":